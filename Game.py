@@ -5,13 +5,48 @@ import time
 import math
 import pyttsx3
 import threading
+import os
+import multiprocessing
+import queue
+import signal
+import tempfile
+import hashlib
+import json
+import contextlib
+import zlib
+import bisect
+import logging
+import logging.handlers
+import argparse
+import sys
+try:
+    import fcntl  # Locks the search cache between processes; not available on Windows
+except ImportError:
+    fcntl = None
 
 # Initialize pygame
 pygame.init()
 
-# Initialize text-to-speech engine
-engine = pyttsx3.init()
+# Text-to-speech runs on one worker thread that owns the pyttsx3 engine; it is
+# started by start_speech_worker() rather than at import time
+tts_engine = None
 tts_thread = None
+tts_queue = queue.Queue(maxsize=1)  # Only the newest pending utterance is kept
+tts_sounds = {}  # Phrase -> pygame Sound of its pre-synthesised audio
+TTS_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gomoku_tts')
+
+# Fixed texts the game shows and speaks; spoken_phrases() has them synthesised once to audio files
+SUGGESTION_PLAYER_WIN = "You can win in the next move! Look for the winning spot."
+SUGGESTION_BLOCK_WIN = "Alert: Block the AI from winning in the next move!"
+SUGGESTION_OPEN_FOUR = "You can create a strong line! Try to build an open four."
+SUGGESTION_BLOCK_OPEN_FOUR = "Alert: Prevent the AI from creating a strong line."
+SUGGESTION_OPEN_THREE = "Consider building up your line to threaten the AI."
+SUGGESTION_GENERAL = "Think strategically to outmaneuver the AI."
+END_MESSAGES = {  # Winner -> the end screen's two lines
+    'Player': ("Congratulations!", "You Win!"),
+    'AI': ("You Lose!", "Don't Give Up!"),
+    'Draw': ("It's a Draw!", ""),
+}
 
 # Constants
 BOARD_SIZE = 14
@@ -49,6 +84,8 @@ GENERAL_TIP_COLOR = (0, 128, 128)  # Teal color for general tips
 EASY = 1
 MEDIUM = 2
 HARD = 3
+MCTS = 4  # Monte Carlo tree search
+LEVEL_NAMES = ['Easy', 'Medium', 'Hard', 'MCTS']
 
 # Players
 PLAYER = 1
@@ -60,6 +97,24 @@ pygame.display.set_caption("5 in a Row (Gomoku)")
 
 # Game board
 board = np.zeros((BOARD_SIZE, BOARD_SIZE))
+move_history = []  # (x, y, player) of every real move in the current game
+
+# Finished games are appended to this JSON-lines archive when it is set
+GAME_ARCHIVE_FILE = os.environ.get('GOMOKU_ARCHIVE', '')
+
+# Cached surfaces for offscreen rendering (empty board, stone sprites)
+render_cache = {}
+
+# Runtime telemetry, off unless GOMOKU_TELEMETRY is set: latency histograms for
+# AI moves, hints, suggestions and frames, plus depth and nodes of every AI move,
+# written as JSON lines to a rotating log file. Press T in a game for an overlay.
+TELEMETRY_ENABLED = bool(os.environ.get('GOMOKU_TELEMETRY'))
+TELEMETRY_FILE = os.environ.get('GOMOKU_TELEMETRY_FILE', 'gomoku_telemetry.log')
+TELEMETRY_MAX_BYTES = 1 << 20  # Size at which the log file is rotated
+TELEMETRY_BACKUPS = 3  # Rotated files kept
+TELEMETRY_FLUSH_INTERVAL = 30.0  # Seconds between histogram snapshots in the log
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+telemetry = {'histograms': {}, 'logger': None, 'last_flush': time.time(), 'overlay': False, 'last_ai_move': None}
 
 # Directions for 5-in-a-row checking
 directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
@@ -75,25 +130,124 @@ SCORES = {
     'BLOCKED_TWO': 10,
 }
 
-
-def draw_board():
+# Weights used by evaluate_board() in the search. They start as SCORES and are
+# replaced by a tuned weight file when one exists (see fit_evaluation_weights());
+# SCORES itself keeps defining the threat levels used by hints and move ordering.
+EVAL_WEIGHTS = dict(SCORES)
+EVAL_WEIGHTS_FILE = os.environ.get('GOMOKU_WEIGHTS', 'gomoku_weights.json')
+FEATURE_PATTERNS = list(SCORES)  # Feature order of the tuning dataset
+TUNED_PATTERNS = [p for p in FEATURE_PATTERNS if p != 'FIVE']  # A five is a win, not a weight to fit
+
+# Threat index: for each player, the empty cells that would create a given
+# pattern there. Kept in sync with the real board by place_stone().
+THREAT_PATTERNS = ['FIVE', 'OPEN_FOUR', 'BLOCKED_FOUR', 'OPEN_THREE']
+threat_scores = np.zeros((3, BOARD_SIZE, BOARD_SIZE))  # Indexed by player, x, y
+threat_index = {p: {name: set() for name in THREAT_PATTERNS} for p in (PLAYER, AI)}
+
+# Zobrist keys for hashing positions (fixed seed so hashes are stable between runs)
+_zobrist_rng = random.Random(0x5EED)
+ZOBRIST = [[[_zobrist_rng.getrandbits(64) for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+           for _ in range(3)]
+board_hash = 0
+
+# Search state for HARD: transposition table, killer moves per ply and a
+# history table that is kept across searches
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+TT_MAX_ENTRIES = 500000
+MOVE_ORDERING = True  # Set to False to measure the effect of move ordering
+transposition_table = {}
+killer_moves = {}
+history_table = np.zeros((3, BOARD_SIZE, BOARD_SIZE))
+search_stats = {'nodes': 0, 'cutoffs': 0, 'first_move_cutoffs': 0, 'tt_hits': 0,
+                'pvs_researches': 0, 'aspiration_researches': 0, 'qnodes': 0, 'qcaps': 0, 'depth': 0, 'playouts': 0,
+                'timed_out': False}
+pv_table = {}  # Principal variation found below each ply
+ASPIRATION_WINDOW = 500  # Half-width of the root window around the previous iteration's score
+last_hard_search = {'move': None, 'score': 0, 'pv': []}  # Result of the latest HARD move, for analysis output
+
+# Quiescence: past depth 0 only forcing moves (fours and their blocks) are searched
+QUIESCENCE_MAX_DEPTH = 6  # Extra plies allowed below the nominal depth
+QUIESCENCE_NODE_LIMIT = 200  # Quiescence nodes allowed below each leaf
+QUIESCENCE_OPEN_THREES = False  # Also extend open threes and the blocks of open fours
+quiescence_cap = QUIESCENCE_NODE_LIMIT  # Value of search_stats['qnodes'] where the current leaf's cap runs out
+
+# Monte Carlo tree search (MCTS level): an array-backed tree in a node pool that is
+# reused between moves, with playouts run as batches of boards in NumPy
+MCTS_POOL_SIZE = 200000  # Nodes in the pool
+MCTS_TIME_LIMIT = 3.0  # Seconds per move
+MCTS_PLAYOUT_BATCH = 8  # Playouts run together from each expanded leaf; small, so the tree keeps growing
+MCTS_EXPLORATION = 1.4  # UCT exploration constant
+MCTS_PRIOR_WEIGHT = 5.0  # Bonus for the root moves the threat index rates best, fading as they get visits
+MCTS_PROCESSES = 1  # Processes running independent searches that are merged at the root
+mcts_pool = {}
+mcts_rng = np.random.default_rng()
+mcts_workers = None
+
+# Game clock for the AI: a total budget per game plus an increment per move,
+# shared out between moves by allocate_move_time()
+GAME_TIME_BUDGET = 120.0  # Seconds for all of the AI's moves in one game
+TIME_INCREMENT = 2.0  # Seconds added back after each AI move
+EXPECTED_GAME_LENGTH = 60  # Stones on the board when a typical game ends
+MAX_MOVE_SHARE = 0.25  # Never plan to spend more than this share of the remaining time
+VOLATILITY_THRESHOLD = 2000  # Score swing between iterations that earns a move extra time
+HARD_MAX_DEPTH = 10  # Only a safety cap: HARD deepens until the clock stops it
+game_clock = {'remaining': GAME_TIME_BUDGET, 'increment': TIME_INCREMENT}
+
+# Analysis mode: a background process deepens the search and streams the
+# top moves, scores and principal variations after every finished depth
+ANALYSIS_TOP_K = 3  # Moves shown in the side panel and hint overlay
+ANALYSIS_MAX_DEPTH = 4
+analysis = {'process': None, 'queue': None, 'key': None, 'depth': 0, 'lines': []}
+
+# Replay viewer: archived games keep a board snapshot every few plies, so
+# seeking restores the nearest snapshot and replays only the moves after it.
+# A background process evaluates every position while the game is watched.
+REPLAY = 'replay'  # start_menu() result that opens the replay viewer
+REPLAY_SNAPSHOT_INTERVAL = 16  # Plies between board snapshots in a game record
+REPLAY_AUTOPLAY_DELAY = 0.8  # Seconds per ply when the replay plays itself
+REPLAY_EVAL_TIME_LIMIT = 2.0  # Seconds of analysis per replayed position
+SCRUBBER_HEIGHT = 12  # Height of the seek bar under the board
+
+# Optional on-disk cache of HARD search results, keyed by the position hash
+# reduced over the board's 8 symmetries. It is a fixed-size memory-mapped file,
+# enabled by pointing GOMOKU_SEARCH_CACHE at a path. Worker processes open it
+# read-only; main processes add results and evict the least recently used,
+# taking a lock file so that several games, arenas or servers can share it.
+# Readers take no lock: each stored key is XORed with a hash of its entry, so
+# an entry read while another process rewrites it just fails to match. A
+# stale file is rebuilt aside and swapped in whole, never truncated in place.
+SEARCH_CACHE_FILE = os.environ.get('GOMOKU_SEARCH_CACHE', '')
+SEARCH_CACHE_SLOTS = 1 << 16  # Entries in the file, including the header entry
+SEARCH_CACHE_WAYS = 4  # Entries per bucket
+SEARCH_CACHE_MIN_DEPTH = 3  # Shallower results are cheap to recompute and not stored
+SEARCH_CACHE_MAGIC = 0x474F4D4F4B55  # Marks the header entry
+SEARCH_CACHE_VERSION = 2  # Kept in the header's move field; older files are rebuilt
+SEARCH_CACHE_DTYPE = np.dtype([('key', '<u8'), ('depth', '<i2'), ('move', '<i2'),
+                               ('stamp', '<u4'), ('score', '<f8')])
+search_cache = {'table': None, 'pid': None, 'writable': False, 'lock': None, 'inode': None}
+
+
+def draw_board(surface=None):
     """Draws the game board with grid lines and border."""
-    screen.fill(BG_COLOR)
+    surface = screen if surface is None else surface
+    surface.fill(BG_COLOR)
     # Draw border
     grid_rect = pygame.Rect(MARGIN_LEFT, MARGIN_TOP, GRID_WIDTH, GRID_HEIGHT)
-    pygame.draw.rect(screen, BLACK, grid_rect, BORDER_WIDTH)
+    pygame.draw.rect(surface, BLACK, grid_rect, BORDER_WIDTH)
 
     # Draw grid lines
     for x in range(BOARD_SIZE + 1):
         pygame.draw.line(
-            screen, BLACK,
+            surface, BLACK,
             (MARGIN_LEFT + x * CELL_SIZE, MARGIN_TOP),
             (MARGIN_LEFT + x * CELL_SIZE, MARGIN_TOP + GRID_HEIGHT),
             GRID_LINE_WIDTH
         )
     for y in range(BOARD_SIZE + 1):
         pygame.draw.line(
-            screen, BLACK,
+            surface, BLACK,
             (MARGIN_LEFT, MARGIN_TOP + y * CELL_SIZE),
             (MARGIN_LEFT + GRID_WIDTH, MARGIN_TOP + y * CELL_SIZE),
             GRID_LINE_WIDTH
@@ -123,6 +277,7 @@ def draw_dots():
 def update_display(hover_pos=None, selected_level=None, turn_message=None, winner=None,
                    hint_positions=None, suggestions=None):
     """Updates the display, drawing the grid, placed dots, and relevant messages."""
+    frame_start = time.perf_counter()
     draw_board()  # Draw the grid
 
     # Draw the placed dots
@@ -150,7 +305,7 @@ def update_display(hover_pos=None, selected_level=None, turn_message=None, winne
     font = pygame.font.Font(None, 22)
     title_font = pygame.font.Font(None, 40)
     if selected_level is not None:
-        difficulty_text = f"5 in a Row | Difficulty: {['Easy', 'Medium', 'Hard'][selected_level - 1]}"
+        difficulty_text = f"5 in a Row | Difficulty: {LEVEL_NAMES[selected_level - 1]}"
         difficulty_surface = title_font.render(difficulty_text, True, (0, 100, 200))
         screen.blit(difficulty_surface, (10, GRID_HEIGHT + MARGIN_TOP + 10))
 
@@ -159,7 +314,7 @@ def update_display(hover_pos=None, selected_level=None, turn_message=None, winne
         "How to Play:",
         "Connect 5 dots in a row horizontally, vertically, or diagonally to win!",
         "Click on an empty cell to place your dot.",
-        "Hints are provided to help you!"
+        "Hints are provided to help you! Press A for engine analysis, T for timing stats."
     ]
 
     for i, line in enumerate(instructions):
@@ -177,7 +332,11 @@ def update_display(hover_pos=None, selected_level=None, turn_message=None, winne
     # Draw the side panel with suggestions
     draw_side_panel(suggestions)
 
+    if telemetry['overlay']:
+        draw_telemetry_overlay()
+
     pygame.display.update()
+    record_latency('frame', time.perf_counter() - frame_start)
 
 
 def draw_side_panel(suggestions):
@@ -225,12 +384,316 @@ def draw_side_panel(suggestions):
                 y += suggestion_surface.get_height() + line_spacing
 
 
+def record_latency(metric, seconds):
+    """Adds a latency sample to the metric's histogram; does nothing when telemetry is off."""
+    if not TELEMETRY_ENABLED:
+        return
+    ms = seconds * 1000
+    histogram = telemetry['histograms'].get(metric)
+    if histogram is None:
+        histogram = {'counts': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        telemetry['histograms'][metric] = histogram
+    histogram['counts'][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+    histogram['count'] += 1
+    histogram['total_ms'] += ms
+    histogram['max_ms'] = max(histogram['max_ms'], ms)
+    if time.time() - telemetry['last_flush'] > TELEMETRY_FLUSH_INTERVAL:
+        flush_telemetry()
+
+
+def record_event(kind, **fields):
+    """Writes one telemetry line; does nothing when telemetry is off."""
+    if not TELEMETRY_ENABLED:
+        return
+    logger = telemetry['logger']
+    if logger is None:
+        logger = logging.getLogger('gomoku.telemetry')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            handler = logging.handlers.RotatingFileHandler(
+                TELEMETRY_FILE, maxBytes=TELEMETRY_MAX_BYTES, backupCount=TELEMETRY_BACKUPS)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+        except OSError:
+            pass  # Nowhere to write; the overlay still works
+        telemetry['logger'] = logger
+    logger.info(json.dumps({'ts': round(time.time(), 3), 'type': kind, **fields}))
+
+
+def histogram_percentile(histogram, fraction):
+    """Returns the upper bound (ms) of the bucket holding the given fraction of samples."""
+    target = histogram['count'] * fraction
+    seen = 0
+    for i, count in enumerate(histogram['counts']):
+        seen += count
+        if seen >= target and count:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else histogram['max_ms']
+    return 0
+
+
+def flush_telemetry():
+    """Writes a snapshot line for every latency histogram."""
+    telemetry['last_flush'] = time.time()
+    for metric, histogram in telemetry['histograms'].items():
+        record_event('histogram', metric=metric, buckets_ms=LATENCY_BUCKETS_MS, counts=histogram['counts'],
+                     count=histogram['count'], mean_ms=round(histogram['total_ms'] / histogram['count'], 3),
+                     p50_ms=histogram_percentile(histogram, 0.5), p95_ms=histogram_percentile(histogram, 0.95),
+                     max_ms=round(histogram['max_ms'], 3))
+
+
+def timed_ai_move(level):
+    """Runs get_ai_move(level), recording its latency, search depth, nodes and HARD's PV when telemetry is on."""
+    if not TELEMETRY_ENABLED:
+        return get_ai_move(level)
+    for key in ('nodes', 'qnodes', 'depth', 'playouts'):
+        search_stats[key] = 0
+    last_hard_search.update(move=None, score=0, pv=[])
+    start = time.perf_counter()
+    move = get_ai_move(level)
+    seconds = time.perf_counter() - start
+    name = LEVEL_NAMES[level - 1].lower()
+    record_latency('ai_move_' + name, seconds)
+    telemetry['last_ai_move'] = {'level': name, 'ms': round(seconds * 1000, 1), 'depth': search_stats['depth'],
+                                 'nodes': search_stats['nodes'] + search_stats['qnodes'],
+                                 'playouts': search_stats['playouts']}
+    if last_hard_search['pv']:
+        telemetry['last_ai_move']['score'] = float(last_hard_search['score'])
+        telemetry['last_ai_move']['pv'] = [[int(x), int(y)] for x, y in last_hard_search['pv']]
+    record_event('ai_move', **telemetry['last_ai_move'])
+    return move
+
+
+def draw_telemetry_overlay():
+    """Draws latency percentiles and the last AI move's search statistics over the board."""
+    font = pygame.font.Font(None, 20)
+    if not TELEMETRY_ENABLED:
+        lines = ["Telemetry is off (set GOMOKU_TELEMETRY=1)"]
+    else:
+        lines = [f"{metric}: p50 {histogram_percentile(h, 0.5)}ms  p95 {histogram_percentile(h, 0.95)}ms  n={h['count']}"
+                 for metric, h in sorted(telemetry['histograms'].items())]
+        last = telemetry['last_ai_move']
+        if last:
+            lines.append(f"last AI move: {last['ms']}ms  depth {last['depth']}  nodes {last['nodes']}  "
+                         f"playouts {last['playouts']}")
+            if 'pv' in last:
+                lines.append(f"score {last['score']:+.0f}  PV: " + ' '.join(f"{x},{y}" for x, y in last['pv']))
+    overlay = pygame.Surface((GRID_WIDTH - 20, 10 + 18 * len(lines)), pygame.SRCALPHA)
+    overlay.fill((0, 0, 0, 160))
+    for i, line in enumerate(lines):
+        overlay.blit(font.render(line, True, WHITE), (6, 6 + 18 * i))
+    screen.blit(overlay, (MARGIN_LEFT + 10, MARGIN_TOP + 10))
+
+
+def get_board_background():
+    """Returns the cached surface of the empty board (grid and margins only)."""
+    if 'background' not in render_cache:
+        surface = pygame.Surface((MARGIN_LEFT + GRID_WIDTH + MARGIN_RIGHT, MARGIN_TOP + GRID_HEIGHT + MARGIN_BOTTOM))
+        draw_board(surface)
+        render_cache['background'] = surface
+    return render_cache['background']
+
+
+def get_stone_sprite(player):
+    """Returns the cached sprite of a stone, drawn the same way as draw_dots()."""
+    if player not in render_cache:
+        sprite = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
+        color = DARK_BLUE if player == PLAYER else PURPLE
+        pygame.draw.circle(sprite, color, (CELL_SIZE // 2, CELL_SIZE // 2), CELL_SIZE // 2 - 5)
+        render_cache[player] = sprite
+    return render_cache[player]
+
+
+def blit_stone(surface, x, y, player):
+    """Draws a single stone onto a board surface."""
+    surface.blit(get_stone_sprite(player), (MARGIN_LEFT + x * CELL_SIZE, MARGIN_TOP + y * CELL_SIZE))
+
+
+def render_position(moves, surface=None):
+    """Renders the position after the given (x, y, player) moves, reusing surface if one is passed."""
+    if surface is None:
+        surface = get_board_background().copy()
+    else:
+        surface.blit(get_board_background(), (0, 0))
+    for x, y, player in moves:
+        blit_stone(surface, x, y, player)
+    return surface
+
+
+def render_replay_frames(moves):
+    """Yields (ply, surface) for every move of a game.
+
+    The same surface is reused for every frame and only the new stone is drawn,
+    so save or copy a frame before asking for the next one.
+    """
+    surface = render_position([])
+    yield 0, surface
+    for ply, (x, y, player) in enumerate(moves, 1):
+        blit_stone(surface, x, y, player)
+        yield ply, surface
+
+
+def export_replay(record, out_dir, prefix='game', every_move=True, thumbnail_size=None):
+    """Saves a game record as PNG frames (or just its final position) and returns the file paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    moves = record['moves']
+    frames = render_replay_frames(moves) if every_move else [(len(moves), render_position(moves))]
+    paths = []
+    for ply, surface in frames:
+        if thumbnail_size is not None:
+            surface = pygame.transform.smoothscale(surface, thumbnail_size)
+        path = os.path.join(out_dir, f"{prefix}_{ply:03d}.png")
+        pygame.image.save(surface, path)
+        paths.append(path)
+    return paths
+
+
+def export_replay_job(job):
+    """Process pool entry point for export_replays()."""
+    record, out_dir, prefix, every_move, thumbnail_size = job
+    return export_replay(record, out_dir, prefix, every_move, thumbnail_size)
+
+
+def export_replays(records, out_dir, every_move=True, thumbnail_size=None, processes=None):
+    """Exports many game records to PNG sequences in parallel, one game per task.
+
+    Workers use SDL's dummy video driver; run the calling process with
+    SDL_VIDEODRIVER=dummy as well to avoid opening the game window at all.
+    """
+    jobs = [(record, out_dir, f"game{i:04d}", every_move, thumbnail_size) for i, record in enumerate(records)]
+    pool = headless_pool(processes or os.cpu_count() or 1)
+    try:
+        return pool.map(export_replay_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def save_game_record(path, moves, winner):
+    """Appends a finished game, with its replay snapshots, to a JSON-lines archive."""
+    record = {'board_size': BOARD_SIZE, 'moves': [[int(x), int(y), int(p)] for x, y, p in moves], 'winner': winner,
+              'snapshot_interval': REPLAY_SNAPSHOT_INTERVAL,
+              'snapshots': [encode_snapshot(s) for s in replay_snapshots(moves, REPLAY_SNAPSHOT_INTERVAL)]}
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def load_game_records(path):
+    """Reads the games of a JSON-lines archive written by save_game_record()."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay_snapshots(moves, interval):
+    """Returns the board after 0, interval, 2 * interval, ... plies of a game."""
+    position = np.zeros((BOARD_SIZE, BOARD_SIZE), dtype=np.int8)
+    snapshots = [position.copy()]
+    for ply, (x, y, player) in enumerate(moves, 1):
+        position[x, y] = player
+        if ply % interval == 0:
+            snapshots.append(position.copy())
+    return snapshots
+
+
+def encode_snapshot(position):
+    """Packs a board into a string of one digit per cell, row by row."""
+    return (position.astype(np.uint8).ravel() + ord('0')).tobytes().decode('ascii')
+
+
+def decode_snapshot(text):
+    """Inverse of encode_snapshot()."""
+    cells = np.frombuffer(text.encode('ascii'), dtype=np.uint8) - ord('0')
+    return cells.astype(np.int8).reshape(BOARD_SIZE, BOARD_SIZE)
+
+
+def render_snapshot(position, surface=None):
+    """Renders a board array, reusing surface if one is passed."""
+    if surface is None:
+        surface = get_board_background().copy()
+    else:
+        surface.blit(get_board_background(), (0, 0))
+    for x, y in np.argwhere(position):
+        blit_stone(surface, x, y, int(position[x, y]))
+    return surface
+
+
+def open_replay(record):
+    """Prepares a game record for viewing, positioned before the first move.
+
+    Records archived before snapshots existed get them computed here.
+    """
+    moves = [tuple(move) for move in record['moves']]
+    interval = record.get('snapshot_interval', REPLAY_SNAPSHOT_INTERVAL)
+    if 'snapshots' in record:
+        snapshots = [decode_snapshot(text) for text in record['snapshots']]
+    else:
+        snapshots = replay_snapshots(moves, interval)
+    return {'record': record, 'moves': moves, 'interval': interval, 'snapshots': snapshots, 'ply': 0,
+            'position': snapshots[0].copy(), 'surface': render_snapshot(snapshots[0]),
+            'evaluations': {}, 'process': None, 'queue': None}
+
+
+def seek_replay(replay, ply):
+    """Moves the replay to the position after ply moves and redraws its surface.
+
+    Stepping forward draws just the new stone; any other jump starts from the
+    nearest earlier snapshot, so fewer than interval moves are replayed.
+    """
+    moves = replay['moves']
+    ply = max(0, min(ply, len(moves)))
+    if ply == replay['ply'] + 1:
+        x, y, player = moves[ply - 1]
+        replay['position'][x, y] = player
+        blit_stone(replay['surface'], x, y, player)
+    elif ply != replay['ply']:
+        base = min(ply // replay['interval'], len(replay['snapshots']) - 1)
+        position = replay['snapshots'][base].copy()
+        for x, y, player in moves[base * replay['interval']:ply]:
+            position[x, y] = player
+        replay['position'] = position
+        render_snapshot(position, replay['surface'])
+    replay['ply'] = ply
+    return replay['surface']
+
+
 def is_valid_move(x, y):
     return 0 <= x < BOARD_SIZE and 0 <= y < BOARD_SIZE and board[x, y] == 0
 
 
 def make_move(x, y, player):
+    global board_hash
     board[x, y] = player
+    board_hash ^= ZOBRIST[player][x][y]
+
+
+def undo_move(x, y):
+    """Removes the stone at (x, y), keeping the position hash in sync."""
+    global board_hash
+    board_hash ^= ZOBRIST[int(board[x, y])][x][y]
+    board[x, y] = 0
+
+
+def compute_hash(position):
+    """Computes the Zobrist hash of a board from scratch."""
+    h = 0
+    for x, y in np.argwhere(position != 0):
+        h ^= ZOBRIST[int(position[x, y])][x][y]
+    return h
+
+
+def place_stone(x, y, player):
+    """Plays a real (non-search) move and keeps the threat index up to date."""
+    make_move(x, y, player)
+    update_threat_index(x, y)
+    move_history.append((x, y, player))
+
+
+def set_board(new_board):
+    """Replaces the game board and rebuilds everything derived from it."""
+    global board, board_hash
+    board = np.array(new_board, dtype=float)
+    board_hash = compute_hash(board)
+    rebuild_threat_index()
 
 
 def check_win(player):
@@ -265,32 +728,21 @@ def random_ai_move():
 
 def block_player_threats(threat_level):
     """Check for player's potential threats and block them based on the threat level."""
-    best_move = None
-    best_score = -float('inf')
-    for x, y in get_all_possible_moves():
-        if is_valid_move(x, y):
-            make_move(x, y, PLAYER)
-            threat = evaluate_board(PLAYER)
-            board[x, y] = 0
-            if threat >= threat_level and threat > best_score:
-                best_score = threat
-                best_move = (x, y)
-    return best_move
+    return best_indexed_move(PLAYER, threat_level)
 
 
 def create_ai_opportunities(opportunity_level):
     """Try to create potential winning opportunities for AI."""
-    best_move = None
-    best_score = -float('inf')
-    for x, y in get_all_possible_moves():
-        if is_valid_move(x, y):
-            make_move(x, y, AI)
-            score = evaluate_board(AI)
-            board[x, y] = 0
-            if score >= opportunity_level and score > best_score:
-                best_score = score
-                best_move = (x, y)
-    return best_move
+    return best_indexed_move(AI, opportunity_level)
+
+
+def best_indexed_move(player, min_score):
+    """Returns the empty cell with the highest threat score for the player, if it reaches min_score."""
+    scores = threat_scores[player]
+    x, y = np.unravel_index(np.argmax(scores), scores.shape)
+    if scores[x, y] < min_score or scores[x, y] <= 0:
+        return None
+    return (int(x), int(y))
 
 
 def get_all_possible_moves():
@@ -319,37 +771,29 @@ def get_ai_move(level):
             if is_valid_move(x, y):
                 make_move(x, y, AI)
                 if check_win(AI):
-                    board[x, y] = 0
+                    undo_move(x, y)
                     return (x, y)
-                board[x, y] = 0
+                undo_move(x, y)
         # Block player's winning move
         for x, y in get_all_possible_moves():
             if is_valid_move(x, y):
                 make_move(x, y, PLAYER)
                 if check_win(PLAYER):
-                    board[x, y] = 0
+                    undo_move(x, y)
                     return (x, y)
-                board[x, y] = 0
+                undo_move(x, y)
         # Else, make a random move
         return random_ai_move()
     elif level == MEDIUM:
-        # Medium level: AI is more strategic
+        # Medium level: AI is more strategic, reading moves from the threat index
         # First, try to win
-        for x, y in get_all_possible_moves():
-            if is_valid_move(x, y):
-                make_move(x, y, AI)
-                if check_win(AI):
-                    board[x, y] = 0
-                    return (x, y)
-                board[x, y] = 0
+        ai_win_moves = get_winning_moves(AI)
+        if ai_win_moves:
+            return ai_win_moves[0]
         # Block player's winning move
-        for x, y in get_all_possible_moves():
-            if is_valid_move(x, y):
-                make_move(x, y, PLAYER)
-                if check_win(PLAYER):
-                    board[x, y] = 0
-                    return (x, y)
-                board[x, y] = 0
+        player_win_moves = get_winning_moves(PLAYER)
+        if player_win_moves:
+            return player_win_moves[0]
         # Then, block player's threats and create AI opportunities
         move = block_player_threats(SCORES['OPEN_THREE'])
         if move:
@@ -359,24 +803,23 @@ def get_ai_move(level):
             return move
         # Else, make a random move
         return random_ai_move()
+    elif level == MCTS:
+        # MCTS level: Monte Carlo tree search, given its share of the game clock. It can
+        # stop at any moment, so it just uses the planned time and never needs the hard limit.
+        soft_limit = allocate_move_time()[0]
+        return get_mcts_move(min(soft_limit, MCTS_TIME_LIMIT), processes=MCTS_PROCESSES)
     elif level == HARD:
-        # Hard level: AI uses Minimax algorithm with deeper search depth
-        depth = 3  # Increase depth to make AI more challenging
-        best_score = -float('inf')
-        best_move = None
-
-        # Start the timer to prevent the AI from exceeding time limit
-        start_time = time.time()
-        time_limit = 5.0  # AI has up to 5 seconds to make a move
+        # Hard level: iterative deepening, as deep as the time manager allows
+        # Moves with only one sensible reply are played without searching
+        forced = forced_ai_move()
+        if forced:
+            return forced
 
-        for move in get_all_possible_moves():
-            make_move(move[0], move[1], AI)
-            score = minimax(depth - 1, -float('inf'), float('inf'), False, AI, start_time, time_limit)
-            board[move[0], move[1]] = 0  # Undo move
+        # The time manager decides how long this move may take
+        soft_limit, time_limit = allocate_move_time()
 
-            if score > best_score:
-                best_score = score
-                best_move = move
+        best_move, best_score, pv = search_hard(HARD_MAX_DEPTH, time_limit, soft_limit)
+        last_hard_search.update(move=best_move, score=best_score, pv=pv)
 
         if best_move is None:
             return random_ai_move()
@@ -384,38 +827,1260 @@ def get_ai_move(level):
             return best_move
 
 
-def minimax(depth, alpha, beta, maximizingPlayer, player, start_time, time_limit):
+def start_game_clock(total=GAME_TIME_BUDGET, increment=TIME_INCREMENT):
+    """Resets the AI's clock at the start of a game."""
+    game_clock['remaining'] = total
+    game_clock['increment'] = increment
+
+
+def charge_clock(elapsed):
+    """Takes the time used by an AI move off the clock and adds the increment."""
+    game_clock['remaining'] = max(game_clock['remaining'] - elapsed, 0) + game_clock['increment']
+
+
+def allocate_move_time():
+    """Returns (soft_limit, hard_limit) in seconds for the next AI move."""
+    stones = int(np.count_nonzero(board))
+    remaining = game_clock['remaining']
+    # Spread the clock over the moves the AI is still expected to play
+    moves_left = max((EXPECTED_GAME_LENGTH - stones) / 2, 10)
+    soft_limit = remaining / moves_left + game_clock['increment'] * 0.8
+    # The opening needs little thought; the middlegame decides most games
+    if stones < 6:
+        soft_limit *= 0.5
+    elif stones < 40:
+        soft_limit *= 1.3
+    soft_limit = max(min(soft_limit, remaining * MAX_MOVE_SHARE), 0.05)
+    hard_limit = max(min(soft_limit * 3, remaining * 0.5), soft_limit)
+    return soft_limit, hard_limit
+
+
+def forced_ai_move():
+    """Returns the AI's move when there is only one sensible reply, so no search is needed."""
+    if not board.any():
+        center = BOARD_SIZE // 2
+        return (center, center)
+    ai_win_moves = get_winning_moves(AI)
+    if ai_win_moves:
+        return ai_win_moves[0]
+    player_win_moves = get_winning_moves(PLAYER)
+    if player_win_moves:
+        # A four must be blocked; against two of them the game is lost anyway
+        return player_win_moves[0]
+    empty_cells = np.argwhere(board == 0)
+    if len(empty_cells) == 1:
+        return (int(empty_cells[0][0]), int(empty_cells[0][1]))
+    return None
+
+
+def search_hard(max_depth, time_limit, soft_limit=None):
+    """Iterative deepening with aspiration windows; returns (best_move, best_score, pv).
+
+    After soft_limit seconds no new iteration is started, unless the score is
+    still swinging between iterations; time_limit is never exceeded.
+    """
+    new_search()
+
+    # A deep enough result from an earlier game or process answers the search
+    # outright; a shallower one still gives the root a hash move
+    cached = search_cache_probe(board)
+    if cached:
+        cached_depth, cached_score, cached_move = cached
+        if cached_depth >= max_depth:
+            return cached_move, cached_score, [cached_move]
+        transposition_table[(board_hash, AI, True)] = (cached_depth, cached_score, TT_EXACT, cached_move)
+    # Start the timer to prevent the AI from exceeding time limit
+    start_time = time.time()
+    best_move, best_score, best_pv = None, -float('inf'), []
+    swing = 0
+    iteration_time = 0
+
+    for depth in range(1, max_depth + 1):
+        elapsed = time.time() - start_time
+        if soft_limit is not None and best_move is not None:
+            limit = soft_limit * 2 if swing > VOLATILITY_THRESHOLD else soft_limit
+            # Each iteration costs several times the previous one; don't start one that can't finish
+            if elapsed > limit or elapsed + iteration_time * 3 > time_limit:
+                break
+        iteration_start = time.time()
+
+        alpha, beta = -float('inf'), float('inf')
+        if best_move is not None:
+            alpha, beta = best_score - ASPIRATION_WINDOW, best_score + ASPIRATION_WINDOW
+        move, score, pv = search_root(depth, alpha, beta, start_time, time_limit)
+        if (score <= alpha or score >= beta) and not search_stats['timed_out']:
+            # Outside the aspiration window: the score is only a bound, search again
+            search_stats['aspiration_researches'] += 1
+            move, score, pv = search_root(depth, -float('inf'), float('inf'), start_time, time_limit)
+
+        # An iteration cut short by the time limit is only used if nothing better exists
+        if search_stats['timed_out'] and best_move is not None:
+            break
+        if best_move is not None:
+            swing = abs(score - best_score)
+        iteration_time = time.time() - iteration_start
+        best_move, best_score, best_pv = move, score, pv
+        if search_stats['timed_out']:
+            break
+        transposition_table[(board_hash, AI, True)] = (depth, score, TT_EXACT, move)
+        search_stats['depth'] = depth
+        if depth == max_depth and depth >= SEARCH_CACHE_MIN_DEPTH:
+            search_cache_store(board, depth, score, move)
+
+    return best_move, best_score, best_pv
+
+
+def analyse_position(position, side=AI, top_k=ANALYSIS_TOP_K, max_depth=ANALYSIS_MAX_DEPTH, time_limit=None):
+    """Yields {'depth', 'lines'} after each depth, lines being the top_k (move, score, pv) for side.
+
+    Scores are from side's point of view. Works without a window, e.g. for
+    annotating archived games; the global board is restored afterwards.
+    """
+    saved = board.copy()
+    set_board(position if side == AI else flip_colours(position))
+    try:
+        if not (board == 0).any():
+            return
+        new_search()
+        cached = search_cache_probe(board)
+        if cached:
+            # Depth 0, so the stored result only orders the root and never replaces its search
+            transposition_table[(board_hash, AI, True)] = (0, cached[1], TT_EXACT, cached[2])
+        start_time = time.time()
+        limit = float('inf') if time_limit is None else time_limit
+        for depth in range(1, max_depth + 1):
+            lines = search_multipv(depth, top_k, start_time, limit)
+            if search_stats['timed_out'] or not lines:
+                break
+            transposition_table[(board_hash, AI, True)] = (depth, lines[0][1], TT_EXACT, lines[0][0])
+            yield {'depth': depth, 'lines': lines}
+    finally:
+        set_board(saved)
+
+
+def search_multipv(depth, top_k, start_time, time_limit):
+    """Scores the AI's root moves and returns the best top_k as (move, score, pv), best first."""
+    lines = []
+    for move in order_moves(get_all_possible_moves(), AI, 0, tt_move(True, AI)):
+        # Only a move that can still enter the top_k needs an exact score
+        alpha = lines[-1][1] if len(lines) >= top_k else -float('inf')
+        make_move(move[0], move[1], AI)
+        score = minimax(depth - 1, alpha, float('inf'), False, AI, start_time, time_limit, 1)
+        pv = [move] + pv_table.get(1, [])
+        undo_move(move[0], move[1])
+        if score > alpha:
+            lines.append((move, score, pv))
+            lines.sort(key=lambda line: -line[1])
+            del lines[top_k:]
+    return lines
+
+
+def game_positions(moves):
+    """Yields (ply, position, side to move) for every position of a game; position is reused."""
+    position = np.zeros((BOARD_SIZE, BOARD_SIZE))
+    for ply in range(len(moves) + 1):
+        side = moves[ply][2] if ply < len(moves) else (PLAYER if moves and moves[-1][2] == AI else AI)
+        yield ply, position, side
+        if ply < len(moves):
+            x, y, player = moves[ply]
+            position[x, y] = player
+
+
+def deepest_analysis(position, side, top_k, max_depth, time_limit):
+    """Returns the last result of analyse_position(), or None if there was nothing to analyse."""
+    result = None
+    for result in analyse_position(position, side, top_k, max_depth, time_limit):
+        pass
+    return result
+
+
+def annotate_game(record, top_k=ANALYSIS_TOP_K, max_depth=ANALYSIS_MAX_DEPTH, time_limit=None):
+    """Returns the deepest analysis of every position of a game record, for the side to move."""
+    return [deepest_analysis(position, side, top_k, max_depth, time_limit)
+            for ply, position, side in game_positions(record['moves'])]
+
+
+def start_analysis(side, top_k=ANALYSIS_TOP_K, max_depth=ANALYSIS_MAX_DEPTH):
+    """Starts analysing the current board in a background process, replacing any running analysis."""
+    stop_analysis()
+    analysis['queue'] = multiprocessing.Queue()
+    with headless_sdl():
+        analysis['process'] = multiprocessing.Process(
+            target=analysis_worker, args=(board.copy(), side, top_k, max_depth, analysis['queue']), daemon=True)
+        analysis['process'].start()
+    analysis['key'] = board_hash
+
+
+def analysis_worker(position, side, top_k, max_depth, results):
+    """Background process entry point: streams each finished depth to the results queue."""
+    restore_sigterm()
+    for update in analyse_position(position, side, top_k, max_depth):
+        results.put(update)
+
+
+def poll_analysis():
+    """Collects results that have arrived without blocking; returns True if anything changed."""
+    changed = False
+    while analysis['queue'] is not None:
+        try:
+            update = analysis['queue'].get_nowait()
+        except queue.Empty:
+            break
+        analysis['depth'] = update['depth']
+        analysis['lines'] = update['lines']
+        changed = True
+    return changed
+
+
+def stop_analysis():
+    """Stops the background analysis and forgets its results."""
+    if analysis['process'] is not None and analysis['process'].is_alive():
+        analysis['process'].terminate()
+    analysis.update({'process': None, 'queue': None, 'key': None, 'depth': 0, 'lines': []})
+
+
+def analysis_text():
+    """Formats the latest analysis results for the side panel."""
+    if not analysis['lines']:
+        return ["Analysis: thinking..."]
+    return format_analysis(analysis['depth'], analysis['lines'])
+
+
+def format_analysis(depth, lines):
+    """Formats analysis lines as side panel text."""
+    text = [f"Analysis (depth {depth}):"]
+    for rank, (move, score, pv) in enumerate(lines, 1):
+        variation = ' '.join(f"{x},{y}" for x, y in pv)
+        text.append(f"{rank}. {move[0]},{move[1]}  {score:+.0f}  PV: {variation}")
+    return text
+
+
+def start_replay_evaluation(replay, top_k=ANALYSIS_TOP_K, max_depth=ANALYSIS_MAX_DEPTH,
+                            time_limit=REPLAY_EVAL_TIME_LIMIT):
+    """Starts evaluating every position of a replay in a background process."""
+    stop_replay_evaluation(replay)
+    replay['queue'] = multiprocessing.Queue()
+    with headless_sdl():
+        replay['process'] = multiprocessing.Process(
+            target=replay_evaluation_worker, args=(replay['moves'], top_k, max_depth, time_limit, replay['queue']),
+            daemon=True)
+        replay['process'].start()
+
+
+def replay_evaluation_worker(moves, top_k, max_depth, time_limit, results):
+    """Background process entry point: sends (ply, side, result) for each position in order."""
+    restore_sigterm()
+    for ply, position, side in game_positions(moves):
+        results.put((ply, side, deepest_analysis(position, side, top_k, max_depth, time_limit)))
+
+
+def poll_replay_evaluation(replay):
+    """Collects finished evaluations without blocking; returns True if anything arrived."""
+    changed = False
+    while replay['queue'] is not None:
+        try:
+            ply, side, result = replay['queue'].get_nowait()
+        except queue.Empty:
+            break
+        replay['evaluations'][ply] = (side, result)
+        changed = True
+    return changed
+
+
+def stop_replay_evaluation(replay):
+    """Stops a replay's background evaluation, keeping the evaluations already received."""
+    if replay['process'] is not None and replay['process'].is_alive():
+        replay['process'].terminate()
+    replay['process'] = None
+    replay['queue'] = None
+
+
+def replay_text(replay, index, games):
+    """Side panel text for the current replay position."""
+    moves = replay['moves']
+    ply = replay['ply']
+    text = [f"Game {index + 1}/{games} | Winner: {replay['record'].get('winner') or 'none'}",
+            f"Move {ply}/{len(moves)}"]
+    if ply:
+        x, y, player = moves[ply - 1]
+        text.append(f"Last move: {'Player' if player == PLAYER else 'AI'} {x},{y}")
+    evaluation = replay['evaluations'].get(ply)
+    if evaluation is None:
+        text.append("Analysis: pending...")
+    elif evaluation[1] is None:
+        text.append("Analysis: nothing to analyse")
+    else:
+        side, result = evaluation
+        text.append(f"{'Player' if side == PLAYER else 'AI'} to move")
+        text += format_analysis(result['depth'], result['lines'])
+    return text
+
+
+def draw_replay(replay, index, games, autoplay):
+    """Draws the replay board, its seek bar, highlights and the side panel."""
+    screen.fill(BG_COLOR)
+    screen.blit(replay['surface'], (0, 0))
+    ply = replay['ply']
+    if ply:
+        x, y, player = replay['moves'][ply - 1]
+        pygame.draw.rect(screen, ALERT_COLOR,
+                         (MARGIN_LEFT + x * CELL_SIZE, MARGIN_TOP + y * CELL_SIZE, CELL_SIZE, CELL_SIZE), 2)
+    evaluation = replay['evaluations'].get(ply)
+    if evaluation is not None and evaluation[1] is not None:
+        x, y = evaluation[1]['lines'][0][0]
+        pygame.draw.rect(screen, HINT_COLOR,
+                         (MARGIN_LEFT + x * CELL_SIZE, MARGIN_TOP + y * CELL_SIZE, CELL_SIZE, CELL_SIZE), 3)
+
+    # Seek bar: the filled part is the share of the game played so far
+    bar = scrubber_rect()
+    pygame.draw.rect(screen, WHITE, bar)
+    if replay['moves']:
+        pygame.draw.rect(screen, BUTTON_COLOR, (bar.x, bar.y, bar.width * ply // len(replay['moves']), bar.height))
+    pygame.draw.rect(screen, BLACK, bar, 1)
+
+    font = pygame.font.Font(None, 22)
+    instructions = [
+        f"Replay{' (playing)' if autoplay else ''}: Left/Right step, PgUp/PgDn jump, Home/End, click the bar to seek.",
+        "Space plays or pauses, Up/Down switch game, Esc returns to the menu."
+    ]
+    for i, line in enumerate(instructions):
+        screen.blit(font.render(line, True, GRID_TEXT_COLOR), (10, bar.bottom + 10 + i * 20))
+
+    draw_side_panel(replay_text(replay, index, games))
+    pygame.display.update()
+
+
+def scrubber_rect():
+    """Returns the rectangle of the replay seek bar."""
+    return pygame.Rect(MARGIN_LEFT, MARGIN_TOP + GRID_HEIGHT + 10, GRID_WIDTH, SCRUBBER_HEIGHT)
+
+
+def replay_mode(records):
+    """Steps through archived games, newest first; returns False if the window was closed."""
+    records = [record for record in records if record.get('board_size') == BOARD_SIZE]
+    if not records:
+        return True
+    index = len(records) - 1
+    replay = open_replay(records[index])
+    start_replay_evaluation(replay)
+    clock = pygame.time.Clock()
+    autoplay = False
+    last_step = time.time()
+    need_update = True
+    try:
+        while True:
+            target = replay['ply']
+            switch = 0
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return False
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return True
+                    elif event.key == pygame.K_RIGHT:
+                        target += 1
+                    elif event.key == pygame.K_LEFT:
+                        target -= 1
+                    elif event.key == pygame.K_PAGEDOWN:
+                        target += replay['interval']
+                    elif event.key == pygame.K_PAGEUP:
+                        target -= replay['interval']
+                    elif event.key == pygame.K_HOME:
+                        target = 0
+                    elif event.key == pygame.K_END:
+                        target = len(replay['moves'])
+                    elif event.key == pygame.K_SPACE:
+                        autoplay = not autoplay
+                        last_step = time.time()
+                    elif event.key == pygame.K_UP:
+                        switch = -1
+                    elif event.key == pygame.K_DOWN:
+                        switch = 1
+                    need_update = True
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    bar = scrubber_rect().inflate(0, 10)
+                    if bar.collidepoint(event.pos):
+                        share = (event.pos[0] - bar.x) / bar.width
+                        target = round(share * len(replay['moves']))
+                        need_update = True
+
+            if switch and 0 <= index + switch < len(records):
+                stop_replay_evaluation(replay)
+                index += switch
+                replay = open_replay(records[index])
+                start_replay_evaluation(replay)
+                autoplay = False
+                continue
+
+            if autoplay and time.time() - last_step >= REPLAY_AUTOPLAY_DELAY:
+                target += 1
+                last_step = time.time()
+                if target >= len(replay['moves']):
+                    autoplay = False
+                need_update = True
+
+            if target != replay['ply']:
+                seek_replay(replay, target)
+            if poll_replay_evaluation(replay):
+                need_update = True
+            if need_update:
+                draw_replay(replay, index, len(records), autoplay)
+                need_update = False
+            clock.tick(30)
+    finally:
+        stop_replay_evaluation(replay)
+
+
+def open_search_cache():
+    """Maps the search cache file on first use; returns the table or None if the cache is off.
+
+    A process forked after its parent mapped the file maps it again, read-only.
+    """
+    if search_cache['pid'] == os.getpid():
+        return search_cache['table']
+    search_cache.update({'table': None, 'pid': os.getpid(), 'writable': False, 'lock': None, 'inode': None})
+    if not SEARCH_CACHE_FILE:
+        return None
+    # Only main processes write; workers share the mapping read-only
+    writable = multiprocessing.current_process().name == 'MainProcess'
+    table = None
+    try:
+        if writable:
+            search_cache['lock'] = open(SEARCH_CACHE_FILE + '.lock', 'a')
+        with search_cache_lock():
+            if os.path.exists(SEARCH_CACHE_FILE):
+                table = np.lib.format.open_memmap(SEARCH_CACHE_FILE, mode='r+' if writable else 'r')
+                if not search_cache_header_ok(table):
+                    table = None  # Written for another board size, layout or evaluation
+            if table is None and writable:
+                # Built under another name and renamed over the old file, so processes that
+                # still map the old one keep a complete table instead of a truncated file
+                temp_file = '%s.%d.tmp' % (SEARCH_CACHE_FILE, os.getpid())
+                new_table = np.lib.format.open_memmap(temp_file, mode='w+', dtype=SEARCH_CACHE_DTYPE,
+                                                      shape=(SEARCH_CACHE_SLOTS,))
+                new_table[0] = (SEARCH_CACHE_MAGIC, BOARD_SIZE, SEARCH_CACHE_VERSION, 0, weights_fingerprint())
+                new_table.flush()
+                del new_table
+                os.replace(temp_file, SEARCH_CACHE_FILE)
+                table = np.lib.format.open_memmap(SEARCH_CACHE_FILE, mode='r+')
+            if table is not None:
+                search_cache['inode'] = os.stat(SEARCH_CACHE_FILE).st_ino
+    except (OSError, ValueError):
+        table = None
+    search_cache['table'] = table
+    search_cache['writable'] = writable and table is not None
+    return table
+
+
+def search_cache_header_ok(table):
+    """Returns True if the table was written for this board size, cache layout and evaluation."""
+    header = table[0]
+    return (table.dtype == SEARCH_CACHE_DTYPE and len(table) == SEARCH_CACHE_SLOTS and
+            header['key'] == SEARCH_CACHE_MAGIC and header['depth'] == BOARD_SIZE and
+            header['move'] == SEARCH_CACHE_VERSION and header['score'] == weights_fingerprint())
+
+
+def search_cache_current():
+    """Returns True if the mapped table is still the cache file and still matches the evaluation."""
+    try:
+        inode = os.stat(SEARCH_CACHE_FILE).st_ino
+    except OSError:
+        return False
+    return inode == search_cache['inode'] and search_cache_header_ok(search_cache['table'])
+
+
+def current_search_cache():
+    """Returns the search cache table, mapping the file again if it was replaced or the weights changed."""
+    table = open_search_cache()
+    if table is not None and not search_cache_current():
+        if search_cache['lock'] is not None:
+            search_cache['lock'].close()
+        search_cache['pid'] = None
+        table = open_search_cache()
+    return table
+
+
+@contextlib.contextmanager
+def search_cache_lock():
+    """Holds the cache's lock file while the block runs; does nothing for read-only users or without fcntl."""
+    lock = search_cache['lock']
+    if lock is None or fcntl is None:
+        yield
+        return
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def search_cache_check(entries):
+    """Mixes the depth, move and score of each entry into a 64-bit value; stored keys are XORed with it."""
+    return ((entries['depth'].astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^
+            (entries['move'].astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)) ^
+            np.ascontiguousarray(entries['score']).view(np.uint64))
+
+
+def board_symmetries(position):
+    """Yields (transformed_board, cells) for the 8 symmetries; cells maps each new cell to its old one."""
+    cells = np.arange(BOARD_SIZE * BOARD_SIZE).reshape(BOARD_SIZE, BOARD_SIZE)
+    for k in range(4):
+        rotated_board, rotated_cells = np.rot90(position, k), np.rot90(cells, k)
+        yield rotated_board, rotated_cells.ravel()
+        yield np.fliplr(rotated_board), np.fliplr(rotated_cells).ravel()
+
+
+def canonical_key(position):
+    """Returns (key, cells): the smallest hash over the board's symmetries and its cell mapping."""
+    return min(((compute_hash(b) or 1, cells) for b, cells in board_symmetries(position)),
+               key=lambda item: item[0])
+
+
+def search_cache_bucket(key):
+    """Returns the slice of the table holding the entries for a key."""
+    start = 1 + (key % ((SEARCH_CACHE_SLOTS - 1) // SEARCH_CACHE_WAYS)) * SEARCH_CACHE_WAYS
+    return slice(start, start + SEARCH_CACHE_WAYS)
+
+
+def search_cache_probe(position):
+    """Returns (depth, score, move) stored for the position with the AI to move, or None."""
+    table = current_search_cache()
+    if table is None:
+        return None
+    key, cells = canonical_key(position)
+    bucket = search_cache_bucket(key)
+    # Work on a copy, so the entry checked is the entry used even if a writer is busy
+    entries = np.array(table[bucket])
+    hits = np.flatnonzero(entries['key'] ^ search_cache_check(entries) == key)
+    if not len(hits):
+        return None
+    entry = entries[hits[0]]
+    x, y = divmod(int(cells[entry['move']]), BOARD_SIZE)
+    if position[x, y] != 0:
+        return None
+    if search_cache['writable']:
+        with search_cache_lock():
+            if search_cache_current():
+                table['stamp'][0] += 1
+                table['stamp'][bucket.start + hits[0]] = table['stamp'][0]
+    return int(entry['depth']), float(entry['score']), (x, y)
+
+
+def search_cache_store(position, depth, score, move):
+    """Stores a search result, replacing a shallower one or the least recently used entry of its bucket."""
+    table = current_search_cache()
+    if table is None or not search_cache['writable'] or move is None:
+        return
+    key, cells = canonical_key(position)
+    bucket = search_cache_bucket(key)
+    new_cell = int(np.flatnonzero(cells == move[0] * BOARD_SIZE + move[1])[0])
+    entry = np.array([(0, depth, new_cell, 0, score)], dtype=SEARCH_CACHE_DTYPE)
+    entry['key'] = key ^ search_cache_check(entry)
+    with search_cache_lock():
+        # Another process may have replaced the file since the check above
+        if not search_cache_current():
+            return
+        entries = table[bucket]
+        keys = entries['key'] ^ search_cache_check(entries)
+        hits = np.flatnonzero(keys == key)
+        if len(hits):
+            slot = bucket.start + hits[0]
+            if table['depth'][slot] > depth:
+                return
+        else:
+            slot = bucket.start + int(np.argmin(np.where(keys == 0, -1, entries['stamp'].astype(np.int64))))
+        table['stamp'][0] += 1
+        entry['stamp'] = table['stamp'][0]
+        table[slot] = entry[0]
+
+
+def flush_search_cache():
+    """Writes pending cache changes to disk."""
+    if search_cache['writable']:
+        search_cache['table'].flush()
+
+
+def search_root(depth, alpha, beta, start_time, time_limit):
+    """Principal variation search over the AI's root moves; returns (best_move, best_score, pv)."""
+    best_score = -float('inf')
+    best_move = None
+    best_pv = []
+
+    for i, move in enumerate(order_moves(get_all_possible_moves(), AI, 0, tt_move(True, AI))):
+        make_move(move[0], move[1], AI)
+        if i == 0:
+            score = minimax(depth - 1, alpha, beta, False, AI, start_time, time_limit, 1)
+        else:
+            # Null-window search to prove the move is no better than the current best
+            score = minimax(depth - 1, alpha, alpha + 1, False, AI, start_time, time_limit, 1)
+            if alpha < score < beta:
+                search_stats['pvs_researches'] += 1
+                score = minimax(depth - 1, alpha, beta, False, AI, start_time, time_limit, 1)
+        undo_move(move[0], move[1])
+
+        if score > best_score:
+            best_score = score
+            best_move = move
+            best_pv = [move] + pv_table.get(1, [])
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+
+    return best_move, best_score, best_pv
+
+
+def new_search():
+    """Resets the per-search state; the history table is only aged, not cleared."""
+    killer_moves.clear()
+    pv_table.clear()
+    history_table[:] /= 2
+    if len(transposition_table) > TT_MAX_ENTRIES:
+        transposition_table.clear()
+    for key in search_stats:
+        search_stats[key] = False if key == 'timed_out' else 0
+
+
+def first_move_cutoff_rate():
+    """Returns the share of beta cutoffs produced by the first move searched."""
+    if not search_stats['cutoffs']:
+        return 0.0
+    return search_stats['first_move_cutoffs'] / search_stats['cutoffs']
+
+
+def measure_move_ordering(depth=3):
+    """Searches the current board with and without move ordering and returns the stats of both."""
+    global MOVE_ORDERING
+    results = {}
+    saved = MOVE_ORDERING
+    # The search state carried between moves is set aside, so a game in progress keeps it
+    saved_table, saved_history = dict(transposition_table), history_table.copy()
+    saved_killers, saved_stats = dict(killer_moves), dict(search_stats)
+    try:
+        for ordering in (False, True):
+            MOVE_ORDERING = ordering
+            transposition_table.clear()
+            history_table.fill(0)
+            new_search()
+            search_root(depth, -float('inf'), float('inf'), time.time(), float('inf'))
+            results[ordering] = dict(search_stats, first_move_cutoff_rate=first_move_cutoff_rate())
+    finally:
+        MOVE_ORDERING = saved
+        transposition_table.clear()
+        transposition_table.update(saved_table)
+        history_table[:] = saved_history
+        killer_moves.clear()
+        killer_moves.update(saved_killers)
+        search_stats.update(saved_stats)
+    return results
+
+
+def tt_move(maximizingPlayer, player):
+    """Returns the best move stored in the transposition table for the current position."""
+    entry = transposition_table.get((board_hash, player, maximizingPlayer))
+    return entry[3] if entry else None
+
+
+def order_moves(moves, mover, ply, hash_move=None):
+    """Orders moves: hash move, wins, forced blocks, killers, history, then static pattern score."""
+    if not MOVE_ORDERING:
+        return list(moves)
+    opponent = PLAYER if mover == AI else AI
+    killers = killer_moves.get(ply, [])
+    keyed = []
+    for move in moves:
+        x, y = move
+        attack = cell_patterns(x, y, mover)
+        defence = cell_patterns(x, y, opponent)
+        if move == hash_move:
+            tier = 0
+        elif 'FIVE' in attack:
+            tier = 1
+        elif 'FIVE' in defence:
+            tier = 2
+        elif move in killers:
+            tier = 3
+        else:
+            tier = 4
+        static = sum(SCORES[p] for p in attack) + sum(SCORES[p] for p in defence)
+        keyed.append(((tier, -history_table[mover, x, y], -static), move))
+    keyed.sort(key=lambda item: item[0])
+    return [move for _, move in keyed]
+
+
+def record_cutoff(move, mover, depth, ply, index):
+    """Updates cutoff statistics, killer moves and the history table after a beta cutoff."""
+    search_stats['cutoffs'] += 1
+    if index == 0:
+        search_stats['first_move_cutoffs'] += 1
+    killers = killer_moves.setdefault(ply, [])
+    if move not in killers:
+        killers.insert(0, move)
+        del killers[2:]
+    history_table[mover, move[0], move[1]] += depth * depth
+
+
+def minimax(depth, alpha, beta, maximizingPlayer, player, start_time, time_limit, ply=0):
+    global quiescence_cap
     opponent = PLAYER if player == AI else AI
+    search_stats['nodes'] += 1
+    pv_table[ply] = []
 
     # Check for timeout to prevent AI from exceeding time limit
     if time.time() - start_time > time_limit:
+        search_stats['timed_out'] = True
         return evaluate_board(player)
 
-    if depth == 0 or check_win(player) or check_win(opponent):
+    if check_win(player) or check_win(opponent):
         return evaluate_board(player)
 
+    if depth == 0:
+        # Every leaf gets the same quiescence budget, so sibling scores stay comparable
+        quiescence_cap = search_stats['qnodes'] + QUIESCENCE_NODE_LIMIT
+        return quiescence(alpha, beta, maximizingPlayer, player, start_time, time_limit, ply)
+
+    # Probe the transposition table
+    key = (board_hash, player, maximizingPlayer)
+    entry = transposition_table.get(key)
+    hash_move = None
+    if entry:
+        tt_depth, tt_score, tt_flag, hash_move = entry
+        if tt_depth >= depth and (tt_flag == TT_EXACT or
+                                  (tt_flag == TT_LOWER and tt_score >= beta) or
+                                  (tt_flag == TT_UPPER and tt_score <= alpha)):
+            search_stats['tt_hits'] += 1
+            return tt_score
+    alpha_orig, beta_orig = alpha, beta
+    best_move = None
+    qcaps = search_stats['qcaps']
+
     if maximizingPlayer:
         maxEval = -float('inf')
-        for move in get_all_possible_moves():
+        for i, move in enumerate(order_moves(get_all_possible_moves(), player, ply, hash_move)):
             make_move(move[0], move[1], player)
-            eval = minimax(depth - 1, alpha, beta, False, player, start_time, time_limit)
-            board[move[0], move[1]] = 0  # Undo move
-            maxEval = max(maxEval, eval)
+            if i == 0:
+                eval = minimax(depth - 1, alpha, beta, False, player, start_time, time_limit, ply + 1)
+            else:
+                # Principal variation search: null window first, full window only if it fails high
+                eval = minimax(depth - 1, alpha, alpha + 1, False, player, start_time, time_limit, ply + 1)
+                if alpha < eval < beta:
+                    search_stats['pvs_researches'] += 1
+                    eval = minimax(depth - 1, alpha, beta, False, player, start_time, time_limit, ply + 1)
+            undo_move(move[0], move[1])
+            if eval > maxEval:
+                maxEval = eval
+                best_move = move
+                pv_table[ply] = [move] + pv_table.get(ply + 1, [])
             alpha = max(alpha, eval)
             if beta <= alpha:
+                record_cutoff(move, player, depth, ply, i)
                 break
-        return maxEval
+        best = maxEval
     else:
         minEval = float('inf')
-        for move in get_all_possible_moves():
+        for i, move in enumerate(order_moves(get_all_possible_moves(), opponent, ply, hash_move)):
             make_move(move[0], move[1], opponent)
-            eval = minimax(depth - 1, alpha, beta, True, player, start_time, time_limit)
-            board[move[0], move[1]] = 0  # Undo move
-            minEval = min(minEval, eval)
+            if i == 0:
+                eval = minimax(depth - 1, alpha, beta, True, player, start_time, time_limit, ply + 1)
+            else:
+                eval = minimax(depth - 1, beta - 1, beta, True, player, start_time, time_limit, ply + 1)
+                if alpha < eval < beta:
+                    search_stats['pvs_researches'] += 1
+                    eval = minimax(depth - 1, alpha, beta, True, player, start_time, time_limit, ply + 1)
+            undo_move(move[0], move[1])
+            if eval < minEval:
+                minEval = eval
+                best_move = move
+                pv_table[ply] = [move] + pv_table.get(ply + 1, [])
             beta = min(beta, eval)
             if beta <= alpha:
+                record_cutoff(move, opponent, depth, ply, i)
                 break
-        return minEval
+        best = minEval
+
+    # Results of a search that ran out of time or quiescence budget are unreliable, so don't keep them
+    if not search_stats['timed_out'] and search_stats['qcaps'] == qcaps:
+        if best <= alpha_orig:
+            flag = TT_UPPER
+        elif best >= beta_orig:
+            flag = TT_LOWER
+        else:
+            flag = TT_EXACT
+        transposition_table[key] = (depth, best, flag, best_move)
+    return best
+
+
+def quiescence(alpha, beta, maximizingPlayer, player, start_time, time_limit, ply, qdepth=0):
+    """Keeps searching forcing moves only, so leaves are not evaluated in the middle of a threat."""
+    opponent = PLAYER if player == AI else AI
+    mover = player if maximizingPlayer else opponent
+    search_stats['qnodes'] += 1
+    pv_table[ply] = []
+
+    if search_stats['qnodes'] > quiescence_cap:
+        search_stats['qcaps'] += 1
+        return evaluate_board(player)
+    if qdepth >= QUIESCENCE_MAX_DEPTH or time.time() - start_time > time_limit:
+        return evaluate_board(player)
+
+    # Quiet positions, the vast majority of leaves, stop here without classifying any cell
+    won, cells = threat_cells(mover)
+    if won or not cells:
+        return evaluate_board(player)
+    moves, forced = forcing_moves(mover, cells)
+    if not moves:
+        return evaluate_board(player)
+
+    # Unless the mover has to answer a four, it may also decline all forcing moves
+    if maximizingPlayer:
+        best = -float('inf')
+        if not forced:
+            stand_pat = evaluate_board(player)
+            if stand_pat >= beta:
+                return stand_pat
+            best = stand_pat
+            alpha = max(alpha, stand_pat)
+    else:
+        best = float('inf')
+        if not forced:
+            stand_pat = evaluate_board(player)
+            if stand_pat <= alpha:
+                return stand_pat
+            best = stand_pat
+            beta = min(beta, stand_pat)
+
+    for move in moves:
+        make_move(move[0], move[1], mover)
+        eval = quiescence(alpha, beta, not maximizingPlayer, player, start_time, time_limit, ply + 1, qdepth + 1)
+        undo_move(move[0], move[1])
+        improved = eval > best if maximizingPlayer else eval < best
+        if improved:
+            best = eval
+            pv_table[ply] = [move] + pv_table.get(ply + 1, [])
+        if maximizingPlayer:
+            alpha = max(alpha, eval)
+        else:
+            beta = min(beta, eval)
+        if beta <= alpha:
+            break
+    return best
+
+
+def window_counts(player):
+    """Counts the player's stones in every five-cell window, one array per entry of directions."""
+    stones = (board == player).astype(np.int8)
+    n = BOARD_SIZE - 4
+    return [sum(stones[i:i + n, :] for i in range(5)),
+            sum(stones[:, i:i + n] for i in range(5)),
+            sum(stones[i:i + n, i:i + n] for i in range(5)),
+            sum(stones[i:i + n, 4 - i:4 - i + n] for i in range(5))]
+
+
+def threat_cells(mover):
+    """Cheap scan before forcing_moves(); returns (won, cells).
+
+    won means a five is on the board. cells are the empty cells of every
+    five-cell window, free of the other colour, in which the mover could make
+    a four or the opponent a five; forcing moves can only be among them.
+    """
+    opponent = PLAYER if mover == AI else AI
+    mover_need, opponent_need = (2, 3) if QUIESCENCE_OPEN_THREES else (3, 4)
+    cells = set()
+    for own, other, (dx, dy) in zip(window_counts(mover), window_counts(opponent), directions):
+        if (own == 5).any() or (other == 5).any():
+            return True, []
+        live = ((own >= mover_need) & (other == 0)) | ((other >= opponent_need) & (own == 0))
+        for i, j in np.argwhere(live):
+            # Window origin in board coordinates; anti-diagonal windows start at their top end
+            x, y = i, j + 4 if dy < 0 else j
+            for k in range(5):
+                if board[x + k * dx, y + k * dy] == 0:
+                    cells.add((int(x + k * dx), int(y + k * dy)))
+    return False, sorted(cells)
+
+
+def forcing_moves(mover, cells):
+    """Returns (moves, forced): winning moves, blocks of the opponent's fours, or the mover's own fours.
+
+    Only the given cells, normally from threat_cells(), are examined. forced is
+    True when the mover has no quiet alternative (it wins or must block).
+    """
+    opponent = PLAYER if mover == AI else AI
+    wins, blocks, threats = [], [], []
+    for x, y in cells:
+        attack = cell_patterns(x, y, mover)
+        defence = cell_patterns(x, y, opponent)
+        if 'FIVE' in attack:
+            wins.append((x, y))
+        elif 'FIVE' in defence:
+            blocks.append((x, y))
+        elif 'OPEN_FOUR' in attack or 'BLOCKED_FOUR' in attack:
+            threats.append((x, y))
+        elif QUIESCENCE_OPEN_THREES and ('OPEN_THREE' in attack or 'OPEN_FOUR' in defence):
+            threats.append((x, y))
+    if wins:
+        return wins[:1], True
+    if blocks:
+        return blocks, True
+    return threats, False
+
+
+def mcts_reset_pool():
+    """Allocates the MCTS node pool on first use, otherwise just empties it."""
+    if not mcts_pool:
+        mcts_pool.update({
+            'parent': np.full(MCTS_POOL_SIZE, -1, dtype=np.int32),
+            'move': np.zeros(MCTS_POOL_SIZE, dtype=np.int32),  # Cell index x * BOARD_SIZE + y
+            'player': np.zeros(MCTS_POOL_SIZE, dtype=np.int8),  # Player who made the move
+            'first_child': np.full(MCTS_POOL_SIZE, -1, dtype=np.int32),
+            'num_children': np.zeros(MCTS_POOL_SIZE, dtype=np.int32),
+            'visits': np.zeros(MCTS_POOL_SIZE),
+            'wins': np.zeros(MCTS_POOL_SIZE),  # From the point of view of 'player'
+            'terminal': np.zeros(MCTS_POOL_SIZE, dtype=bool),
+            'prior': np.zeros(MCTS_POOL_SIZE),  # Threat index rating in [0, 1]; only set for root children
+        })
+    mcts_pool['size'] = 0
+    mcts_pool['root'] = mcts_new_node(-1, -1, PLAYER)
+    mcts_pool['root_board'] = board.astype(np.int8)
+
+
+def mcts_new_node(parent, move, player):
+    """Takes the next free node from the pool and returns its index."""
+    node = mcts_pool['size']
+    mcts_pool['size'] += 1
+    mcts_pool['parent'][node] = parent
+    mcts_pool['move'][node] = move
+    mcts_pool['player'][node] = player
+    mcts_pool['first_child'][node] = -1
+    mcts_pool['num_children'][node] = 0
+    mcts_pool['visits'][node] = 0
+    mcts_pool['wins'][node] = 0
+    mcts_pool['terminal'][node] = False
+    mcts_pool['prior'][node] = 0
+    return node
+
+
+def mcts_find_child(node, move, player):
+    """Returns the child of node reached by the given move, or -1."""
+    first = mcts_pool['first_child'][node]
+    for child in range(first, first + mcts_pool['num_children'][node]):
+        if mcts_pool['move'][child] == move and mcts_pool['player'][child] == player:
+            return child
+    return -1
+
+
+def mcts_prepare_root():
+    """Reuses the subtree of the previous search if the board only gained the two expected moves."""
+    if not mcts_pool or mcts_pool['size'] > MCTS_POOL_SIZE * 0.8:
+        mcts_reset_pool()
+        return
+    old = mcts_pool['root_board']
+    changed = np.argwhere(board != old)
+    node = mcts_pool['root']
+    if len(changed) == 2 and not old[tuple(changed.T)].any():
+        # The AI's previous move first, then the player's reply
+        for player in (AI, PLAYER):
+            for x, y in changed:
+                if board[x, y] == player:
+                    node = mcts_find_child(node, x * BOARD_SIZE + y, player) if node >= 0 else -1
+        if node >= 0:
+            mcts_pool['root'] = node
+            mcts_pool['parent'][node] = -1
+            mcts_pool['root_board'] = board.astype(np.int8)
+            return
+    mcts_reset_pool()
+
+
+def mcts_expand(node, position):
+    """Adds a child for every empty cell next to a stone; returns False if the pool is full."""
+    candidates = np.flatnonzero(neighbour_mask((position != 0)[None])[0] & (position == 0))
+    if len(candidates) == 0:
+        candidates = np.flatnonzero(position == 0)
+    if mcts_pool['size'] + len(candidates) > MCTS_POOL_SIZE:
+        return False
+    mover = PLAYER if mcts_pool['player'][node] == AI else AI
+    mcts_pool['first_child'][node] = mcts_pool['size']
+    mcts_pool['num_children'][node] = len(candidates)
+    for move in candidates:
+        mcts_new_node(node, move, mover)
+    return True
+
+
+def mcts_select_child(node):
+    """Picks the child with the highest UCT value; unvisited children come first."""
+    first = mcts_pool['first_child'][node]
+    children = slice(first, first + mcts_pool['num_children'][node])
+    visits = mcts_pool['visits'][children]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        uct = (mcts_pool['wins'][children] / visits +
+               MCTS_EXPLORATION * np.sqrt(math.log(mcts_pool['visits'][node] + 1) / visits))
+    uct += MCTS_EXPLORATION * MCTS_PRIOR_WEIGHT * mcts_pool['prior'][children] / (visits + 1)
+    uct[visits == 0] = np.inf
+    best = np.flatnonzero(uct == uct.max())
+    return first + int(best[mcts_rng.integers(len(best))])
+
+
+def mcts_set_priors(root):
+    """Expands the root if needed and rates its children by the threat index, attack and defence alike.
+
+    Unvisited children are still tried once each; the prior only decides where
+    the early visits go, while random playouts are still too few to tell.
+    """
+    if mcts_pool['num_children'][root] == 0 and not mcts_expand(root, mcts_pool['root_board']):
+        return
+    first = mcts_pool['first_child'][root]
+    children = slice(first, first + mcts_pool['num_children'][root])
+    moves = mcts_pool['move'][children]
+    ratings = (threat_scores[AI].ravel()[moves] + threat_scores[PLAYER].ravel()[moves])
+    mcts_pool['prior'][children] = ratings / ratings.max() if ratings.max() > 0 else 0
+
+
+def mcts_search(time_limit=None, playouts=None):
+    """Runs MCTS from the current board (AI to move) until the time or playout budget is used."""
+    mcts_prepare_root()
+    root = mcts_pool['root']
+    mcts_set_priors(root)
+    start_time = time.time()
+    done = 0
+    while True:
+        if time_limit is not None and time.time() - start_time >= time_limit:
+            break
+        if playouts is not None and done >= playouts:
+            break
+        if time_limit is None and playouts is None and done >= MCTS_PLAYOUT_BATCH:
+            break
+
+        # Selection: walk down the tree, replaying the moves on a copy of the root board
+        node = root
+        position = mcts_pool['root_board'].copy()
+        while mcts_pool['num_children'][node] > 0 and not mcts_pool['terminal'][node]:
+            node = mcts_select_child(node)
+            move = mcts_pool['move'][node]
+            position[move // BOARD_SIZE, move % BOARD_SIZE] = mcts_pool['player'][node]
+
+        # Expansion: grow the leaf once it has been visited and pick one of its new children
+        if (not mcts_pool['terminal'][node] and mcts_pool['visits'][node] > 0 and (position == 0).any()
+                and mcts_expand(node, position)):
+            node = mcts_select_child(node)
+            move = mcts_pool['move'][node]
+            position[move // BOARD_SIZE, move % BOARD_SIZE] = mcts_pool['player'][node]
+
+        # Simulation: a batch of random playouts, or the known result of a finished game
+        last_player = mcts_pool['player'][node]
+        if node != root and batch_check_win(position[None], last_player)[0]:
+            mcts_pool['terminal'][node] = True
+            winners = np.full(MCTS_PLAYOUT_BATCH, last_player, dtype=np.int8)
+        elif not (position == 0).any():
+            mcts_pool['terminal'][node] = True
+            winners = np.zeros(MCTS_PLAYOUT_BATCH, dtype=np.int8)
+        else:
+            winners = batch_playouts(position, PLAYER if last_player == AI else AI, MCTS_PLAYOUT_BATCH)
+        done += len(winners)
+
+        # Backpropagation: draws count as half a win for both sides
+        draws = np.count_nonzero(winners == 0) * 0.5
+        results = {PLAYER: np.count_nonzero(winners == PLAYER) + draws,
+                   AI: np.count_nonzero(winners == AI) + draws}
+        while node >= 0:
+            mcts_pool['visits'][node] += len(winners)
+            mcts_pool['wins'][node] += results[mcts_pool['player'][node]]
+            node = mcts_pool['parent'][node] if node != root else -1
+
+    search_stats['playouts'] = done
+    return mcts_root_stats(), done
+
+
+def mcts_root_stats():
+    """Returns {move: (visits, wins)} for the children of the root."""
+    root = mcts_pool['root']
+    first = mcts_pool['first_child'][root]
+    stats = {}
+    for child in range(first, first + mcts_pool['num_children'][root]):
+        move = int(mcts_pool['move'][child])
+        stats[(move // BOARD_SIZE, move % BOARD_SIZE)] = (mcts_pool['visits'][child], mcts_pool['wins'][child])
+    return stats
+
+
+def get_mcts_move(time_limit=None, playouts=None, processes=1):
+    """Returns the AI move chosen by MCTS, merging root statistics of several processes if asked."""
+    if not (board == 0).any():
+        return None
+    # Immediate wins and forced blocks don't need a search, and neither do the
+    # open-three tactics that random playouts are too noisy to see
+    forced = forced_ai_move() or tactical_ai_move()
+    if forced:
+        return forced
+    if processes > 1:
+        global mcts_workers
+        if mcts_workers is None:
+            mcts_workers = headless_pool(processes)
+        share = None if playouts is None else max(1, playouts // processes)
+        jobs = [(board.copy(), time_limit, share, seed) for seed in mcts_rng.integers(2 ** 31, size=processes)]
+        stats = {}
+        for worker_stats in mcts_workers.map(mcts_worker, jobs):
+            for move, (visits, wins) in worker_stats.items():
+                total = stats.get(move, (0, 0))
+                stats[move] = (total[0] + visits, total[1] + wins)
+    else:
+        stats, _ = mcts_search(time_limit, playouts)
+    if not stats:
+        return random_ai_move()
+    return max(stats, key=lambda move: stats[move][0])
+
+
+def tactical_ai_move():
+    """Returns a move the threat index makes obvious: an open four for the AI, else blocking the player's."""
+    return create_ai_opportunities(SCORES['OPEN_FOUR']) or block_player_threats(SCORES['OPEN_FOUR'])
+
+
+def mcts_worker(job):
+    """Process pool entry point: runs one independent MCTS search and returns its root statistics."""
+    global mcts_rng
+    position, time_limit, playouts, seed = job
+    set_board(position)  # Also rebuilds the threat index the root priors come from
+    mcts_rng = np.random.default_rng(seed)
+    return mcts_search(time_limit, playouts)[0]
+
+
+def headless_pool(processes):
+    """Starts a process pool whose workers use SDL's dummy drivers, so they never open a window."""
+    with headless_sdl():
+        return multiprocessing.Pool(processes, initializer=restore_sigterm)
+
+
+def restore_sigterm():
+    """Lets a worker process die on SIGTERM again.
+
+    SDL turns SIGTERM into a quit event, and forked workers inherit that
+    handler, so without this terminate() would leave them running.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+@contextlib.contextmanager
+def headless_sdl():
+    """Points SDL at its dummy drivers while child processes are being started."""
+    saved = {key: os.environ.get(key) for key in ('SDL_VIDEODRIVER', 'SDL_AUDIODRIVER')}
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def neighbour_mask(occupied):
+    """Marks every cell next to an occupied one, for a batch of boards of shape (n, size, size)."""
+    near = occupied.copy()
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx or dy:
+                near[:, max(dx, 0):BOARD_SIZE + min(dx, 0), max(dy, 0):BOARD_SIZE + min(dy, 0)] |= \
+                    occupied[:, max(-dx, 0):BOARD_SIZE + min(-dx, 0), max(-dy, 0):BOARD_SIZE + min(-dy, 0)]
+    return near
+
+
+def batch_check_win(boards, player):
+    """Returns, for a batch of boards, whether the player has five in a row on each one."""
+    stones = boards == player
+    n = BOARD_SIZE
+    won = np.zeros(len(boards), dtype=bool)
+    for dx, dy in directions:
+        y0, y1 = (4, n) if dy < 0 else (0, n - 4 * dy)
+        run = stones[:, 0:n - 4 * dx, y0:y1].copy()
+        for i in range(1, 5):
+            run &= stones[:, i * dx:n - 4 * dx + i * dx, y0 + i * dy:y1 + i * dy]
+        won |= run.any(axis=(1, 2))
+    return won
+
+
+def batch_playouts(position, to_move, count):
+    """Plays count random games from position at once; returns the winner of each (0 for a draw)."""
+    boards = np.repeat(position[None].astype(np.int8), count, axis=0)
+    winners = np.zeros(count, dtype=np.int8)
+    active = np.arange(count)
+    player = to_move
+    while len(active):
+        current = boards[active]
+        empty = current == 0
+        # Random moves are kept next to existing stones, like get_all_possible_moves()
+        candidates = neighbour_mask(~empty) & empty
+        candidates[~candidates.any(axis=(1, 2))] = empty[~candidates.any(axis=(1, 2))]
+        playable = candidates.any(axis=(1, 2))
+        active, current, candidates = active[playable], current[playable], candidates[playable]
+        if not len(active):
+            break
+        keys = mcts_rng.random(candidates.shape) * candidates
+        cells = keys.reshape(len(active), -1).argmax(axis=1)
+        current[np.arange(len(active)), cells // BOARD_SIZE, cells % BOARD_SIZE] = player
+        boards[active] = current
+        won = batch_check_win(current, player)
+        winners[active[won]] = player
+        active = active[~won]
+        player = PLAYER if player == AI else AI
+    return winners
+
+
+def flip_colours(position):
+    """Returns a copy of the board with the player's and the AI's stones swapped."""
+    flipped = position.copy()
+    flipped[position == PLAYER] = AI
+    flipped[position == AI] = PLAYER
+    return flipped
+
+
+def engine_move(level, player):
+    """Asks the engine for a move on behalf of either side (the engines always play as AI)."""
+    return play_as(player, lambda: get_ai_move(level))
+
+
+def play_as(player, choose_move):
+    """Calls choose_move() with the board seen from player's side, as if player were the AI."""
+    if player == AI:
+        return choose_move()
+    saved = board.copy()
+    set_board(flip_colours(saved))
+    move = choose_move()
+    set_board(saved)
+    return move
+
+
+def benchmark_mcts_vs_hard(games=4, mcts_time=MCTS_TIME_LIMIT):
+    """Plays MCTS against HARD without a window and reports results and seconds per move."""
+    global MCTS_TIME_LIMIT
+    saved_limit, saved_board, saved_history = MCTS_TIME_LIMIT, board.copy(), list(move_history)
+    MCTS_TIME_LIMIT = mcts_time
+    results = {'MCTS': 0, 'HARD': 0, 'Draw': 0}
+    seconds = {MCTS: [], HARD: []}
+    try:
+        for game in range(games):
+            set_board(np.zeros((BOARD_SIZE, BOARD_SIZE)))
+            move_history.clear()
+            mcts_pool.clear()
+            # Alternate who moves first; the first mover always plays the AI's stones here
+            levels = {AI: MCTS, PLAYER: HARD} if game % 2 == 0 else {AI: HARD, PLAYER: MCTS}
+            player = AI
+            winner = 'Draw'
+            while (board == 0).any():
+                start = time.time()
+                move = engine_move(levels[player], player)
+                seconds[levels[player]].append(time.time() - start)
+                place_stone(move[0], move[1], player)
+                if check_win(player):
+                    winner = 'MCTS' if levels[player] == MCTS else 'HARD'
+                    break
+                player = PLAYER if player == AI else AI
+            results[winner] += 1
+    finally:
+        MCTS_TIME_LIMIT = saved_limit
+        set_board(saved_board)
+        move_history[:] = saved_history
+    results['MCTS seconds/move'] = sum(seconds[MCTS]) / max(len(seconds[MCTS]), 1)
+    results['HARD seconds/move'] = sum(seconds[HARD]) / max(len(seconds[HARD]), 1)
+    return results
 
 
 def evaluate_board(player):
@@ -443,6 +2108,11 @@ def evaluate_position(x, y, player):
 
 def evaluate_line(x, y, dx, dy, player):
     """Evaluates a line starting from (x, y) in direction (dx, dy) for the given player."""
+    return calculate_score(*scan_line(x, y, dx, dy, player))
+
+
+def scan_line(x, y, dx, dy, player):
+    """Returns (count, block, empty) for the run through (x, y) in direction (dx, dy)."""
     count = 1  # Starts with 1 because (x, y) is occupied by player
     block = 0
     empty = 0
@@ -485,44 +2155,344 @@ def evaluate_line(x, y, dx, dy, player):
             break
         i += 1
 
-    return calculate_score(count, block, empty)
+    return count, block, empty
 
 
 def calculate_score(count, block, empty):
+    pattern = classify_line(count, block)
+    return EVAL_WEIGHTS[pattern] if pattern else 0
+
+
+def classify_line(count, block):
+    """Returns the SCORES pattern name for a run, or None if it is worthless."""
     if block == 2 and count < 5:
-        return 0
+        return None
     if count >= 5:
-        return SCORES['FIVE']
+        return 'FIVE'
     if block == 0:
         if count == 4:
-            return SCORES['OPEN_FOUR']
+            return 'OPEN_FOUR'
         elif count == 3:
-            return SCORES['OPEN_THREE']
+            return 'OPEN_THREE'
         elif count == 2:
-            return SCORES['OPEN_TWO']
+            return 'OPEN_TWO'
     elif block == 1:
         if count == 4:
-            return SCORES['BLOCKED_FOUR']
+            return 'BLOCKED_FOUR'
         elif count == 3:
-            return SCORES['BLOCKED_THREE']
+            return 'BLOCKED_THREE'
         elif count == 2:
-            return SCORES['BLOCKED_TWO']
-    return 0
+            return 'BLOCKED_TWO'
+    return None
+
+
+def cell_patterns(x, y, player):
+    """Returns the line patterns the player would form by playing the empty cell (x, y)."""
+    board[x, y] = player
+    patterns = [classify_line(*scan_line(x, y, dx, dy, player)[:2]) for dx, dy in directions]
+    board[x, y] = 0
+    return [p for p in patterns if p]
+
+
+def reset_threat_index():
+    """Clears the threat index for both players."""
+    threat_scores.fill(0)
+    for player in (PLAYER, AI):
+        for name in THREAT_PATTERNS:
+            threat_index[player][name].clear()
+
+
+def index_cell(x, y):
+    """Recomputes the threat index entries of a single cell for both players."""
+    for player in (PLAYER, AI):
+        for name in THREAT_PATTERNS:
+            threat_index[player][name].discard((x, y))
+        threat_scores[player, x, y] = 0
+        if board[x, y] != 0:
+            continue
+        patterns = cell_patterns(x, y, player)
+        threat_scores[player, x, y] = sum(SCORES[p] for p in patterns)
+        for name in patterns:
+            if name in threat_index[player]:
+                threat_index[player][name].add((x, y))
+
+
+def rebuild_threat_index():
+    """Rebuilds the threat index from scratch for the current board."""
+    reset_threat_index()
+    for x, y in get_all_possible_moves():
+        if is_valid_move(x, y):
+            index_cell(x, y)
+
+
+def update_threat_index(x, y):
+    """Updates the threat index after a stone was placed on or removed from (x, y)."""
+    # A stone only changes runs it can reach: 4 friendly stones plus the blocking
+    # end, so cells more than 5 steps away along a line are unaffected.
+    index_cell(x, y)
+    for dx, dy in directions:
+        for i in range(-5, 6):
+            nx = x + dx * i
+            ny = y + dy * i
+            if i != 0 and 0 <= nx < BOARD_SIZE and 0 <= ny < BOARD_SIZE and board[nx, ny] == 0:
+                index_cell(nx, ny)
+
+
+def load_evaluation_weights(path=EVAL_WEIGHTS_FILE):
+    """Loads tuned evaluation weights into EVAL_WEIGHTS if the file exists; returns True if it did."""
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        with open(path) as f:
+            weights = json.load(f)
+    except (OSError, ValueError):
+        return False
+    EVAL_WEIGHTS.update({p: float(weights[p]) for p in TUNED_PATTERNS if p in weights})
+    return True
+
+
+def save_evaluation_weights(weights, path=EVAL_WEIGHTS_FILE):
+    """Writes evaluation weights as JSON."""
+    with open(path, 'w') as f:
+        json.dump({p: weights[p] for p in FEATURE_PATTERNS}, f, indent=2)
+
+
+def weights_fingerprint():
+    """Returns a number identifying the current EVAL_WEIGHTS, so cached scores can be matched to them."""
+    return float(zlib.crc32(json.dumps(sorted(EVAL_WEIGHTS.items())).encode('utf-8')))
+
+
+def position_features():
+    """Counts the line patterns on the board the way evaluate_board(AI) scores them: AI's minus the player's.
+
+    evaluate_board(AI) equals the dot product of these counts with the weights.
+    """
+    features = np.zeros(len(FEATURE_PATTERNS))
+    for x, y in np.argwhere(board != 0):
+        player = board[x, y]
+        sign = 1 if player == AI else -1
+        for dx, dy in directions:
+            pattern = classify_line(*scan_line(x, y, dx, dy, player)[:2])
+            if pattern:
+                features[FEATURE_PATTERNS.index(pattern)] += sign
+    return features
+
+
+def self_play_records(games, level=HARD, opening_moves=4, time_per_move=1.0):
+    """Plays engine-vs-engine games from random openings and returns them as game records.
+
+    HARD is the default because weaker levels mostly fill the board to a draw.
+    It searches for time_per_move seconds, since no game clock runs here.
+    """
+    saved_board, saved_history = board.copy(), list(move_history)
+    records = []
+    try:
+        for _ in range(games):
+            set_board(np.zeros((BOARD_SIZE, BOARD_SIZE)))
+            move_history.clear()
+            player = AI
+            winner = 'Draw'
+            while (board == 0).any():
+                if len(move_history) < opening_moves:
+                    move = random.choice(list(get_all_possible_moves()))
+                elif level == HARD:
+                    move = play_as(player, lambda: fixed_time_hard_move(time_per_move))
+                else:
+                    move = engine_move(level, player)
+                place_stone(move[0], move[1], player)
+                if check_win(player):
+                    winner = 'AI' if player == AI else 'Player'
+                    break
+                player = PLAYER if player == AI else AI
+            records.append({'board_size': BOARD_SIZE,
+                            'moves': [[int(x), int(y), int(p)] for x, y, p in move_history], 'winner': winner})
+    finally:
+        set_board(saved_board)
+        move_history[:] = saved_history
+    return records
+
+
+def extract_positions(records, path, skip_opening=4, include_draws=False):
+    """Writes (features..., outcome) rows for every position of the records to a memory-mapped .npy file.
+
+    The outcome is 1 for an AI win, 0 for a player win and 0.5 for a draw.
+    Drawn games are skipped unless asked for: their many 0.5 rows mostly teach
+    the fit that nothing matters. Returns the number of rows written.
+    """
+    global board
+    if not include_draws:
+        records = [record for record in records if record.get('winner') in ('AI', 'Player')]
+    rows = sum(max(len(record['moves']) - skip_opening, 0) for record in records)
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, len(FEATURE_PATTERNS) + 1))
+    saved = board
+    row = 0
+    try:
+        for record in records:
+            outcome = {'AI': 1.0, 'Player': 0.0}.get(record.get('winner'), 0.5)
+            # Positions are built on a scratch board; hashes and the threat index are not needed here
+            board = np.zeros((BOARD_SIZE, BOARD_SIZE))
+            for ply, (x, y, player) in enumerate(record['moves'], 1):
+                board[x, y] = player
+                if ply > skip_opening:
+                    data[row, :-1] = position_features()
+                    data[row, -1] = outcome
+                    row += 1
+    finally:
+        board = saved
+    data.flush()
+    return row
+
+
+def texel_error(data, weights, scale, batch_size=65536):
+    """Mean squared error between sigmoid(scale * evaluation) and the game outcomes."""
+    total = 0.0
+    for start in range(0, len(data), batch_size):
+        chunk = np.asarray(data[start:start + batch_size], dtype=np.float64)
+        predicted = 1 / (1 + np.exp(-np.clip(chunk[:, :-1] @ weights * scale, -50, 50)))
+        total += np.sum((predicted - chunk[:, -1]) ** 2)
+    return total / max(len(data), 1)
+
+
+def ranked_weights(values):
+    """Returns the closest non-increasing sequence to values (pool adjacent violators)."""
+    blocks = []  # [sum, count] of runs pooled to their mean
+    for value in values:
+        blocks.append([value, 1])
+        while len(blocks) > 1 and blocks[-2][0] * blocks[-1][1] < blocks[-1][0] * blocks[-2][1]:
+            total, count = blocks.pop()
+            blocks[-1][0] += total
+            blocks[-1][1] += count
+    return np.concatenate([np.full(count, total / count) for total, count in blocks])
+
+
+def fit_evaluation_weights(dataset_path, epochs=50, learning_rate=0.02, batch_size=4096, regularization=1e-5):
+    """Fits the pattern weights to a position dataset (Texel tuning) and returns (weights, report).
+
+    The sigmoid scale is fitted to the current weights first, then the log of
+    each weight's multiplier is trained with mini-batch Adam on the squared
+    error, so a step moves a ten and a ten thousand by the same fraction;
+    FIVE is kept fixed. The regularization term pulls the multipliers back
+    towards 1, so a small dataset can't move the weights far. After every
+    step the weights are put back in the order of SCORES, so a two can never
+    end up worth more than a three.
+    """
+    data = np.load(dataset_path, mmap_mode='r')
+    start_weights = np.array([EVAL_WEIGHTS[p] for p in FEATURE_PATTERNS], dtype=np.float64)
+    scales = np.logspace(-7, -1, 61)
+    scale = scales[int(np.argmin([texel_error(data, start_weights, k) for k in scales]))]
+
+    # weights = start_weights * exp(log_multipliers)
+    log_multipliers = np.zeros_like(start_weights)
+    trainable = np.array([p in TUNED_PATTERNS for p in FEATURE_PATTERNS])
+    m = np.zeros_like(log_multipliers)
+    v = np.zeros_like(log_multipliers)
+    step = 0
+    for _ in range(epochs):
+        for start in np.random.permutation(np.arange(0, len(data), batch_size)):
+            chunk = np.asarray(data[start:start + batch_size], dtype=np.float64)
+            features, outcomes = chunk[:, :-1], chunk[:, -1]
+            params = start_weights * np.exp(log_multipliers) * scale
+            predicted = 1 / (1 + np.exp(-np.clip(features @ params, -50, 50)))
+            grad = features.T @ ((predicted - outcomes) * predicted * (1 - predicted)) * 2 / len(chunk) * params
+            grad += 2 * regularization * log_multipliers
+            step += 1
+            m = 0.9 * m + 0.1 * grad
+            v = 0.999 * v + 0.001 * grad ** 2
+            update = learning_rate * (m / (1 - 0.9 ** step)) / (np.sqrt(v / (1 - 0.999 ** step)) + 1e-8)
+            log_multipliers[trainable] -= update[trainable]
+            ranked = ranked_weights(np.minimum(start_weights * np.exp(log_multipliers), start_weights[0])[trainable])
+            log_multipliers[trainable] = np.log(ranked / start_weights[trainable])
+
+    tuned = start_weights * np.exp(log_multipliers)
+    weights = {p: (EVAL_WEIGHTS[p] if p == 'FIVE' else float(round(tuned[i])))
+               for i, p in enumerate(FEATURE_PATTERNS)}
+    report = {
+        'positions': len(data),
+        'scale': float(scale),
+        'error_before': float(texel_error(data, start_weights, scale)),
+        'error_after': float(texel_error(data, np.array([weights[p] for p in FEATURE_PATTERNS]), scale)),
+    }
+    return weights, report
+
+
+def fixed_time_hard_move(time_per_move, max_depth=HARD_MAX_DEPTH):
+    """Returns HARD's move for the AI searched for about time_per_move seconds, without the game clock."""
+    return (forced_ai_move() or search_hard(max_depth, time_per_move, time_per_move / 3)[0] or
+            random_ai_move())
+
+
+def compare_evaluation_weights(weights, games=4, time_per_move=1.0, max_depth=6):
+    """Plays HARD with the given weights against HARD with the current ones at equal time per move."""
+    default = dict(EVAL_WEIGHTS)
+    saved_board, saved_history, saved_cache = board.copy(), list(move_history), dict(search_cache)
+    # Cached scores belong to one evaluation, so the disk cache sits this out
+    search_cache.update({'table': None, 'pid': os.getpid(), 'writable': False, 'lock': None, 'inode': None})
+    results = {'tuned': 0, 'default': 0, 'Draw': 0}
+    try:
+        for game in range(games):
+            set_board(np.zeros((BOARD_SIZE, BOARD_SIZE)))
+            move_history.clear()
+            sides = {AI: 'tuned', PLAYER: 'default'} if game % 2 == 0 else {AI: 'default', PLAYER: 'tuned'}
+            player = AI
+            winner = 'Draw'
+            while (board == 0).any():
+                EVAL_WEIGHTS.update(weights if sides[player] == 'tuned' else default)
+                transposition_table.clear()
+                move = play_as(player, lambda: fixed_time_hard_move(time_per_move, max_depth))
+                place_stone(move[0], move[1], player)
+                if check_win(player):
+                    winner = sides[player]
+                    break
+                player = PLAYER if player == AI else AI
+            results[winner] += 1
+    finally:
+        EVAL_WEIGHTS.update(default)
+        transposition_table.clear()
+        search_cache.update(saved_cache)
+        set_board(saved_board)
+        move_history[:] = saved_history
+    return results
+
+
+def tune_main(argv):
+    """Command line tuning pipeline: game records -> position dataset -> fitted weights -> comparison.
+
+    The weight file is only written when the tuned weights both fit the positions
+    better and win more comparison games than they lose.
+    """
+    parser = argparse.ArgumentParser(prog='Game.py tune', description='Fit the evaluation weights to game outcomes.')
+    parser.add_argument('--records', help='JSON-lines game archive to learn from (default: HARD self-play)')
+    parser.add_argument('--games', type=int, default=20, help='self-play games when no archive is given')
+    parser.add_argument('--dataset', default='gomoku_positions.npy', help='memory-mapped position dataset to write')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--compare-games', type=int, default=4, help='tuned vs current games at equal time')
+    parser.add_argument('--time-per-move', type=float, default=1.0, help='HARD search time in self-play and comparison')
+    parser.add_argument('--out', default=EVAL_WEIGHTS_FILE, help='weight file to write')
+    args = parser.parse_args(argv)
+
+    if args.records:
+        records = load_game_records(args.records)
+    else:
+        records = self_play_records(args.games, time_per_move=args.time_per_move)
+    records = [record for record in records if record.get('board_size', BOARD_SIZE) == BOARD_SIZE]
+    if not extract_positions(records, args.dataset):
+        print("No positions from decisive games to learn from.")
+        return False
+    weights, report = fit_evaluation_weights(args.dataset, epochs=args.epochs)
+    report['weights'] = weights
+    report['comparison'] = compare_evaluation_weights(weights, args.compare_games, args.time_per_move)
+    report['saved'] = (report['error_after'] < report['error_before'] and
+                       report['comparison']['tuned'] > report['comparison']['default'])
+    if report['saved']:
+        save_evaluation_weights(weights, args.out)
+    print(json.dumps(report, indent=2))
+    return report['saved']
 
 
 def get_potential_moves(player, score_type):
     """Finds potential moves that achieve at least the specified score type."""
-    potential_moves = []
     score_threshold = SCORES[score_type]
-
-    for x, y in get_all_possible_moves():
-        if is_valid_move(x, y):
-            make_move(x, y, player)
-            score = evaluate_position(x, y, player)
-            board[x, y] = 0  # Undo move
-            if score >= score_threshold:
-                potential_moves.append((x, y))
-    return potential_moves
+    return [(int(x), int(y)) for x, y in np.argwhere(threat_scores[player] >= score_threshold)]
 
 
 def get_hint_positions(ai_level):
@@ -565,14 +2535,7 @@ def get_hint_positions(ai_level):
 
 def get_winning_moves(player):
     """Finds all winning moves for the given player."""
-    winning_moves = []
-    for x, y in get_all_possible_moves():
-        if is_valid_move(x, y):
-            make_move(x, y, player)
-            if check_win(player):
-                winning_moves.append((x, y))
-            board[x, y] = 0
-    return winning_moves
+    return sorted(threat_index[player]['FIVE'])
 
 
 def get_dynamic_suggestions(player_turn):
@@ -585,34 +2548,34 @@ def get_dynamic_suggestions(player_turn):
         # Check if the player can win in the next move
         player_win_moves = get_winning_moves(PLAYER)
         if player_win_moves:
-            suggestions.append("You can win in the next move! Look for the winning spot.")
+            suggestions.append(SUGGESTION_PLAYER_WIN)
             return suggestions
 
         # Check if the AI can win in the next move
         ai_win_moves = get_winning_moves(AI)
         if ai_win_moves:
-            suggestions.append("Alert: Block the AI from winning in the next move!")
+            suggestions.append(SUGGESTION_BLOCK_WIN)
             return suggestions
 
         # Check if the player can create an open four
         player_open_four_moves = get_potential_moves(PLAYER, 'OPEN_FOUR')
         if player_open_four_moves:
-            suggestions.append("You can create a strong line! Try to build an open four.")
+            suggestions.append(SUGGESTION_OPEN_FOUR)
             return suggestions
 
         # Check if the AI can create an open four
         ai_open_four_moves = get_potential_moves(AI, 'OPEN_FOUR')
         if ai_open_four_moves:
-            suggestions.append("Alert: Prevent the AI from creating a strong line.")
+            suggestions.append(SUGGESTION_BLOCK_OPEN_FOUR)
             return suggestions
 
         # Check if the player can create an open three
         player_open_three_moves = get_potential_moves(PLAYER, 'OPEN_THREE')
         if player_open_three_moves:
-            suggestions.append("Consider building up your line to threaten the AI.")
+            suggestions.append(SUGGESTION_OPEN_THREE)
 
         # General tip
-        suggestions.append("Think strategically to outmaneuver the AI.")
+        suggestions.append(SUGGESTION_GENERAL)
     else:
         # AI's turn: Display static message
         suggestions.append("AI is thinking...")
@@ -621,23 +2584,126 @@ def get_dynamic_suggestions(player_turn):
 
 
 def speak_suggestions(suggestions_text):
+    speak(suggestions_text)
+
+
+def speech_text(lines):
+    """Joins lines of text into one utterance, the way they are spoken and cached."""
+    return ' '.join(line for line in lines if line)
+
+
+def spoken_phrases():
+    """Returns every fixed utterance: each suggestion alone, the only suggestion pair, and the end screens."""
+    suggestions = [SUGGESTION_PLAYER_WIN, SUGGESTION_BLOCK_WIN, SUGGESTION_OPEN_FOUR,
+                   SUGGESTION_BLOCK_OPEN_FOUR, SUGGESTION_GENERAL]
+    phrases = [speech_text([line]) for line in suggestions]
+    phrases.append(speech_text([SUGGESTION_OPEN_THREE, SUGGESTION_GENERAL]))
+    phrases += [speech_text(lines) for lines in END_MESSAGES.values()]
+    return phrases
+
+
+def speak(text):
+    """Queues text for the speech worker, replacing anything it has not spoken yet."""
+    start_speech_worker()
+    try:
+        tts_queue.get_nowait()  # Drop the stale utterance
+    except queue.Empty:
+        pass
+    try:
+        tts_queue.put_nowait(text)
+    except queue.Full:
+        pass
+
+
+def stop_speech():
+    """Drops pending speech and stops whatever is being said."""
+    try:
+        tts_queue.get_nowait()
+    except queue.Empty:
+        pass
+    if pygame.mixer.get_init():
+        pygame.mixer.stop()
+    if tts_engine is not None:
+        tts_engine.stop()
+
+
+def start_speech_worker():
+    """Starts the speech worker thread if it is not running yet."""
     global tts_thread
-    def run():
-        engine.say(suggestions_text)
-        engine.runAndWait()
-    # Stop any ongoing speech before starting new speech
-    engine.stop()
-    tts_thread = threading.Thread(target=run)
-    tts_thread.start()
+    if tts_thread is None:
+        tts_thread = threading.Thread(target=speech_worker, daemon=True)
+        tts_thread.start()
+
+
+def speech_worker():
+    """Owns the TTS engine: synthesises the fixed phrases once, then speaks queued text."""
+    global tts_engine
+    try:
+        tts_engine = pyttsx3.init()
+    except Exception:
+        tts_engine = None  # No speech backend; cached audio may still play
+    load_phrase_cache()
+
+    while True:
+        text = tts_queue.get()
+        if text is None:
+            break
+        sound = tts_sounds.get(text)
+        if sound is not None:
+            # Cached audio plays on a mixer channel without blocking anyone
+            pygame.mixer.stop()
+            sound.play()
+        elif tts_engine is not None:
+            tts_engine.say(text)
+            tts_engine.runAndWait()
+
+
+def load_phrase_cache():
+    """Synthesises missing spoken_phrases() to audio files and loads them as pygame Sounds."""
+    if not pygame.mixer.get_init():
+        return
+    paths = {}
+    for phrase in spoken_phrases():
+        name = hashlib.sha1(phrase.encode('utf-8')).hexdigest() + '.wav'
+        paths[phrase] = os.path.join(TTS_CACHE_DIR, name)
+    missing = [phrase for phrase, path in paths.items() if not os.path.exists(path)]
+    if missing and tts_engine is not None:
+        # Synthesised under temporary names and renamed once complete, so a run
+        # interrupted halfway never leaves a truncated file behind as cached
+        temp_paths = {phrase: '%s.%d.tmp.wav' % (paths[phrase][:-4], os.getpid()) for phrase in missing}
+        try:
+            os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            for phrase in missing:
+                tts_engine.save_to_file(phrase, temp_paths[phrase])
+            tts_engine.runAndWait()
+            for phrase in missing:
+                if os.path.exists(temp_paths[phrase]) and os.path.getsize(temp_paths[phrase]) > 0:
+                    os.replace(temp_paths[phrase], paths[phrase])
+        except (OSError, RuntimeError):
+            pass
+        for temp_path in temp_paths.values():
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+    for phrase, path in paths.items():
+        try:
+            tts_sounds[phrase] = pygame.mixer.Sound(path)
+        except FileNotFoundError:
+            pass  # Spoken live by the engine instead
+        except pygame.error:
+            # Unreadable, e.g. cut short by an older version; synthesised again next time
+            with contextlib.suppress(OSError):
+                os.remove(path)
 
 
 def main_game(ai_level):
-    global board
-    board = np.zeros((BOARD_SIZE, BOARD_SIZE))
+    set_board(np.zeros((BOARD_SIZE, BOARD_SIZE)))
+    move_history.clear()
+    start_game_clock()
     player_turn = AI  # Set AI to go first
     game_over = False
     hover_pos = None
     winner = None
+    analysis_on = False
 
     # Initial suggestions
     suggestions = get_dynamic_suggestions(player_turn)
@@ -649,6 +2715,7 @@ def main_game(ai_level):
     update_display(selected_level=ai_level, turn_message="AI Thinking...", suggestions=suggestions)
 
     suggestions_need_update = True  # Ensure suggestions are spoken at the start
+    turn_hints, hints_key = None, None  # Hints depend only on the position, so they are computed once per turn
 
     while not game_over:
         need_update = False  # Track if a screen update is needed
@@ -659,13 +2726,14 @@ def main_game(ai_level):
             update_display(selected_level=ai_level, turn_message="AI Thinking...", winner=winner, suggestions=suggestions)
             pygame.display.update()
 
-            pygame.time.wait(1000)  # Simulate AI thinking delay
-            ai_move = get_ai_move(ai_level)
+            move_start = time.time()
+            ai_move = timed_ai_move(ai_level)
+            charge_clock(time.time() - move_start)
             if ai_move is None:
                 winner = "Draw"
                 game_over = True
                 break
-            make_move(ai_move[0], ai_move[1], AI)
+            place_stone(ai_move[0], ai_move[1], AI)
             if check_win(AI):
                 winner = "AI"
                 game_over = True
@@ -677,9 +2745,20 @@ def main_game(ai_level):
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                stop_analysis()
                 pygame.quit()
                 return False
 
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_t:
+                telemetry['overlay'] = not telemetry['overlay']
+                need_update = True
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_a:
+                analysis_on = not analysis_on
+                if not analysis_on:
+                    stop_analysis()
+                need_update = True
+
             if event.type == pygame.MOUSEMOTION:
                 mx, my = pygame.mouse.get_pos()
                 if MARGIN_LEFT <= mx < MARGIN_LEFT + GRID_WIDTH and MARGIN_TOP <= my < MARGIN_TOP + GRID_HEIGHT:
@@ -695,7 +2774,7 @@ def main_game(ai_level):
                 if hover_pos:
                     x, y = hover_pos
                     if is_valid_move(x, y):
-                        make_move(x, y, PLAYER)
+                        place_stone(x, y, PLAYER)
                         if check_win(PLAYER):
                             winner = "Player"
                             game_over = True
@@ -703,20 +2782,36 @@ def main_game(ai_level):
                         need_update = True  # Update after player makes a move
                         suggestions_need_update = True  # Update suggestions after player's move
 
-                        # Stop TTS when player's turn ends
-                        engine.stop()
+                        # Stop TTS and analysis when player's turn ends
+                        stop_speech()
+                        stop_analysis()
 
         # Provide hints and alerts on all levels
         if player_turn == PLAYER:
-            hint_positions = get_hint_positions(ai_level)
+            if hints_key != board_hash:
+                hint_start = time.perf_counter()
+                turn_hints, hints_key = get_hint_positions(ai_level), board_hash
+                record_latency('hints', time.perf_counter() - hint_start)
+            hint_positions = turn_hints
+
+        # Analysis mode: results stream in from the background process as each depth finishes
+        if analysis_on and player_turn == PLAYER and not game_over:
+            if analysis['key'] != board_hash:
+                start_analysis(PLAYER)
+            if poll_analysis():
+                need_update = True
+            if analysis['lines']:
+                hint_positions = [line[0] for line in analysis['lines']]
 
         # Update suggestions only when necessary
         if suggestions_need_update and player_turn == PLAYER:
+            suggestions_start = time.perf_counter()
             suggestions = get_dynamic_suggestions(player_turn)
+            record_latency('suggestions', time.perf_counter() - suggestions_start)
             suggestions_need_update = False  # Reset the flag
 
             # Combine suggestions into a single string
-            suggestions_text = ' '.join(suggestions)
+            suggestions_text = speech_text(suggestions)
 
             if suggestions_text != last_spoken_suggestions:
                 speak_suggestions(suggestions_text)
@@ -724,14 +2819,21 @@ def main_game(ai_level):
 
         # Only update the display if needed
         if need_update or hint_positions:
+            panel_lines = suggestions + analysis_text() if analysis_on else suggestions
             update_display(hover_pos, selected_level=ai_level, turn_message="Your Turn", winner=winner,
-                           hint_positions=hint_positions, suggestions=suggestions)
+                           hint_positions=hint_positions, suggestions=panel_lines)
 
         if game_over:
             break
 
-    # Stop TTS when game is over
-    engine.stop()
+    # Stop TTS and analysis when game is over
+    stop_speech()
+    stop_analysis()
+    if TELEMETRY_ENABLED:
+        flush_telemetry()
+
+    if GAME_ARCHIVE_FILE:
+        save_game_record(GAME_ARCHIVE_FILE, move_history, winner)
 
     # Display end screen
     play_again = display_end_screen(winner)
@@ -752,33 +2854,21 @@ def display_end_screen(winner):
             color = (random.randint(150, 255), random.randint(100, 255), random.randint(100, 255))
             fireworks.append({'x': x, 'y': y, 'particles': [], 'color': color})
 
-        message_line1 = "Congratulations!"
-        message_line2 = "You Win!"
+        message_line1, message_line2 = END_MESSAGES['Player']
         background_color = (20, 20, 20)  # Dark background for fireworks
 
-        # Announce the win audibly
-        engine.say("Congratulations! You Win!")
-        engine.runAndWait()
-
     elif winner == "AI":
         background_color = BLACK  # Plain black background
-        message_line1 = "You Lose!"
-        message_line2 = "Don't Give Up!"
+        message_line1, message_line2 = END_MESSAGES['AI']
         fireworks = []  # No fireworks animation
 
-        # Announce the loss audibly
-        engine.say("You Lose! Don't Give Up!")
-        engine.runAndWait()
-
     else:
         background_color = BLACK  # Plain black background for a draw
-        message_line1 = "It's a Draw!"
-        message_line2 = ""  # No second line for a draw
+        message_line1, message_line2 = END_MESSAGES['Draw']  # No second line for a draw
         fireworks = []  # No fireworks animation
 
-        # Announce the draw audibly
-        engine.say("It's a Draw!")
-        engine.runAndWait()
+    # Announce the result audibly
+    speak(speech_text([message_line1, message_line2]))
 
     # Prepare text surfaces
     font_large = pygame.font.Font(None, 80)
@@ -889,7 +2979,9 @@ def start_menu():
     title_height = title_font.size(welcome_text)[1]
     subtitle_height = subtitle_font.size(select_diff_text)[1]
     button_height = 50
-    total_height = title_height + subtitle_height + button_height * 3 + spacing * 5
+    has_archive = bool(GAME_ARCHIVE_FILE) and os.path.exists(GAME_ARCHIVE_FILE)
+    buttons = 5 if has_archive else 4
+    total_height = title_height + subtitle_height + button_height * buttons + spacing * (buttons + 2)
 
     # Starting Y position to center content vertically
     start_y = SCREEN_HEIGHT // 2 - total_height // 2
@@ -916,6 +3008,12 @@ def start_menu():
         button_hard = pygame.Rect(SCREEN_WIDTH // 2 - 100, current_y, 200, button_height)
         current_y += button_height + spacing
 
+        button_mcts = pygame.Rect(SCREEN_WIDTH // 2 - 100, current_y, 200, button_height)
+        current_y += button_height + spacing
+
+        button_replay = pygame.Rect(SCREEN_WIDTH // 2 - 100, current_y, 200, button_height) if has_archive else None
+        current_y += button_height + spacing
+
         # Draw buttons and center the text within the buttons
         if button_easy.collidepoint((mx, my)):
             pygame.draw.rect(screen, BUTTON_HOVER_COLOR, button_easy)
@@ -932,11 +3030,25 @@ def start_menu():
         else:
             pygame.draw.rect(screen, BUTTON_COLOR, button_hard)
 
+        if button_mcts.collidepoint((mx, my)):
+            pygame.draw.rect(screen, BUTTON_HOVER_COLOR, button_mcts)
+        else:
+            pygame.draw.rect(screen, BUTTON_COLOR, button_mcts)
+
+        if button_replay is not None:
+            if button_replay.collidepoint((mx, my)):
+                pygame.draw.rect(screen, BUTTON_HOVER_COLOR, button_replay)
+            else:
+                pygame.draw.rect(screen, BUTTON_COLOR, button_replay)
+
         # Center text within the buttons
         button_font = pygame.font.Font(None, 48)
         draw_text('Easy', button_font, WHITE, screen, button_easy.centery)
         draw_text('Medium', button_font, WHITE, screen, button_medium.centery)
         draw_text('Hard', button_font, WHITE, screen, button_hard.centery)
+        draw_text('MCTS', button_font, WHITE, screen, button_mcts.centery)
+        if button_replay is not None:
+            draw_text('Replays', button_font, WHITE, screen, button_replay.centery)
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -950,18 +3062,44 @@ def start_menu():
                         return MEDIUM
                     if button_hard.collidepoint((mx, my)):
                         return HARD
+                    if button_mcts.collidepoint((mx, my)):
+                        return MCTS
+                    if button_replay is not None and button_replay.collidepoint((mx, my)):
+                        return REPLAY
 
         pygame.display.update()
 
 
+# Use tuned evaluation weights when a weight file is present
+load_evaluation_weights()
+
+
 if __name__ == "__main__":
+    # "python Game.py tune ..." runs the weight tuning pipeline instead of the game
+    if sys.argv[1:2] == ['tune']:
+        tune_main(sys.argv[2:])
+        pygame.quit()
+        sys.exit()
+
+    # Start the speech worker early so phrases are synthesised while the menu is shown
+    start_speech_worker()
+
     # Main game loop to allow replaying the game
     while True:
         ai_level = start_menu()
         if ai_level is None:
             break
+        if ai_level == REPLAY:
+            if not replay_mode(load_game_records(GAME_ARCHIVE_FILE)):
+                break
+            continue
         play_again = main_game(ai_level)
         if not play_again:
             break
+    if mcts_workers is not None:
+        mcts_workers.terminate()
+    flush_search_cache()
+    if TELEMETRY_ENABLED:
+        flush_telemetry()
+    stop_speech()  # Stop the TTS engine when the game exits
     pygame.quit()
-    engine.stop()  # Stop the TTS engine when the game exits